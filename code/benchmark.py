@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import subprocess
+import time
+import timeit
+
+import numpy as np
+
+from perception import camera_calibration, get_rover_grid, terrain_classifier, color_thresh, color_range, \
+    rover_coords, pix_to_world, pix_to_world_batch, perspect_transform, perception_step
+from decision import decision_step
+from supporting_functions import create_output_images
+from frame_store import DatasetRun, open_run
+from replay import replay, set_telemetry
+
+# Recorded run used as input for the benchmarks
+dataset_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'generated_dataset')
+# Folder the results of benchmark runs are saved to, one JSON file per run
+results_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'output', 'benchmarks')
+
+# Define a function to read a recorded camera frame as RGB, the way the simulator sends it.
+# The frame is the image logged on row index of the telemetry log, as synthetic_rover uses
+# the pose of that row (the IMG folder can hold frames the log does not list).
+def load_frame(index=0, folder=dataset_folder):
+    return DatasetRun(folder).image(index)
+
+# Define a function to time a function call, returning the best and median time per call in seconds
+def time_function(function, repeat=7, number=100):
+    times = np.array(timeit.repeat(function, repeat=repeat, number=number)) / number
+    return np.min(times), np.median(times)
+
+# Compare projecting the navigable, rock and obstacle pixels with three pix_to_world calls
+# against a single pix_to_world_batch call
+def benchmark_world_projection(img, repeat=7, number=100):
+    warped = camera_calibration(img.shape).warp(img)
+    navigable, rock, obstacle = terrain_classifier.classify(warped)
+    grid = get_rover_grid(warped.shape)
+    pixel_sets = [grid.select(navigable, grid.in_range),
+                  grid.select(rock, grid.in_rock_range),
+                  grid.select(obstacle, grid.in_range)]
+    pixels = np.concatenate(pixel_sets)
+    xpix, ypix = grid.x[pixels], grid.y[pixels]
+    lengths = [len(pixel_set) for pixel_set in pixel_sets]
+    pose = (99.7, 85.6, 58.4, 200, 10)
+
+    def three_calls():
+        for pixel_set in pixel_sets:
+            pix_to_world(grid.x[pixel_set], grid.y[pixel_set], *pose)
+
+    def batched():
+        pix_to_world_batch(xpix, ypix, lengths, *pose)
+
+    def batched_flat():
+        pix_to_world_batch(xpix, ypix, lengths, *pose, flat=True)
+
+    return {
+        'pix_to_world x3': time_function(three_calls, repeat, number),
+        'pix_to_world_batch': time_function(batched, repeat, number),
+        'pix_to_world_batch flat': time_function(batched_flat, repeat, number),
+    }
+
+# Define a function to create a Rover state as it is midway through a run: the first frames
+# of the run are replayed to fill the worldmap, then the frame to benchmark with is set
+def synthetic_rover(index=0, warmup_frames=200, folder=dataset_folder):
+    run = open_run(folder)
+    Rover, _ = replay(run, 0, min(warmup_frames, len(run)))
+    set_telemetry(Rover, run.telemetry(index), run.image(index), warmup_frames * 0.05)
+    return perception_step(Rover)
+
+# Time the steps of the pipeline on one frame, one after the other
+def benchmark_pipeline(img, Rover, repeat=7, number=100):
+    src = np.float32([[14, 140], [301, 140], [200, 96], [118, 96]])
+    dst = np.float32([[img.shape[1]/2 - 5, img.shape[0] - 10],
+                      [img.shape[1]/2 + 5, img.shape[0] - 10],
+                      [img.shape[1]/2 + 5, img.shape[0] - 20],
+                      [img.shape[1]/2 - 5, img.shape[0] - 20]])
+    warped = perspect_transform(img, src, dst)
+    navigable = color_thresh(warped)
+    xpix, ypix = rover_coords(navigable)
+    pose = (Rover.pos[0], Rover.pos[1], Rover.yaw, Rover.worldmap.shape[0], 10)
+    mode = Rover.mode
+
+    def decide():
+        # Start every call from the same mode so repetitions time the same branch
+        Rover.mode = mode
+        decision_step(Rover)
+
+    return {
+        'color_thresh': time_function(lambda: color_thresh(warped), repeat, number),
+        'color_range': time_function(lambda: color_range(warped), repeat, number),
+        'rover_coords': time_function(lambda: rover_coords(navigable), repeat, number),
+        'pix_to_world': time_function(lambda: pix_to_world(xpix, ypix, *pose), repeat, number),
+        'perspect_transform': time_function(lambda: perspect_transform(img, src, dst), repeat, number),
+        'perception_step': time_function(lambda: perception_step(Rover), repeat, number),
+        'decision_step': time_function(decide, repeat, number),
+        'create_output_images': time_function(lambda: create_output_images(Rover), repeat, max(number // 10, 1)),
+    }
+
+# Define a function to print benchmark results in microseconds, next to those of an earlier
+# run if one is given
+def print_results(results, baseline=None):
+    for name, (best, median) in results.items():
+        line = '{:<40} best {:>10.1f} us   median {:>10.1f} us'.format(name, best * 1e6, median * 1e6)
+        if baseline is not None and name in baseline:
+            line += '   {:>6.2f}x baseline median'.format(median / baseline[name][1])
+        print(line)
+
+# Define a function to save benchmark results as JSON, named after the current git commit
+# unless a name is given. Returns the path written.
+def save_results(results, name=None, folder=results_folder):
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(
+            os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    if name is None:
+        name = commit or time.strftime('%Y%m%d_%H%M%S')
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    path = os.path.join(folder, name + '.json')
+    with open(path, 'w') as results_file:
+        json.dump({'commit': commit, 'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'results': {key: list(value) for key, value in results.items()}}, results_file, indent=2)
+    return path
+
+# Define a function to load saved benchmark results, by name or path
+def load_results(name, folder=results_folder):
+    path = name if os.path.exists(name) else os.path.join(folder, name + '.json')
+    with open(path) as results_file:
+        return {key: tuple(value) for key, value in json.load(results_file)['results'].items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rover benchmarks')
+    parser.add_argument('--frame', type=int, default=0, help='Index of the dataset frame to use.')
+    parser.add_argument('--repeat', type=int, default=7, help='Number of timing repetitions.')
+    parser.add_argument('--number', type=int, default=100, help='Calls per timing repetition.')
+    parser.add_argument('--save', type=str, nargs='?', const='', default=None,
+                        help='Save the results to output/benchmarks, named after the git commit unless a name is given.')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='Name or path of saved results to compare against.')
+    args = parser.parse_args()
+
+    img = load_frame(args.frame)
+    results = benchmark_pipeline(img, synthetic_rover(args.frame), args.repeat, args.number)
+    results.update(benchmark_world_projection(img, args.repeat, args.number))
+    print_results(results, load_results(args.compare) if args.compare else None)
+    if args.save is not None:
+        print('Saved results to {}'.format(save_results(results, args.save or None)))
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+# Fixtures shared by the worldmap tests
+
+
+# Worldmap resolutions the tests run at: 1 m and 0.25 m cells
+@pytest.fixture(params=[1, 4])
+def resolution(request):
+    return request.param
+
+
+# Return the flat cell indices of a frame of detections for each channel, clustered around
+# a random point like the cells seen from the rover
+def random_frame(rng, size):
+    center = rng.integers(0, size, 2)
+    frame = []
+    for channel in range(3):
+        count = rng.integers(0, 200)
+        y = np.clip(center[0] + rng.integers(-12, 13, count), 0, size - 1)
+        x = np.clip(center[1] + rng.integers(-12, 13, count), 0, size - 1)
+        frame.append(y * size + x)
+    return frame
+
+
+@pytest.fixture(name='random_frame')
+def random_frame_fixture():
+    return random_frame
@@ -1,18 +1,187 @@
+import time
+
 import numpy as np
 
-from supporting_functions import distance_between
+from supporting_functions import distance_between, logger
 
 
-# This is where you can build a decision tree for determining throttle, brake and steer 
-# commands based on the output of the perception_step() function
-def decision_step(Rover):
+# Modes the rover can be in -> modes it can switch to from there
+TRANSITIONS = {
+    'forward': ('stop', 'pickup', 'unstuck', 'home'),
+    'stop': ('forward', 'pickup', 'unstuck', 'home'),
+    'pickup': ('forward', 'unstuck', 'home'),
+    'unstuck': ('stop', 'pickup', 'home'),
+    'home': ('home_dance', 'pickup', 'unstuck'),
+    'home_dance': (),
+}
+MODES = tuple(TRANSITIONS)
+
+
+# Define a class for what the rover does in forward mode: drive on, and stop when there is
+# not enough navigable terrain ahead.
+# Mode handlers set the commands for the frame and return the mode to switch to, or None.
+class ForwardMode():
+    # Whether the guards of DecisionMachine run and vision data is needed in this mode
+    guarded = True
+
+    def step(self, Rover):
+        # Check the extent of navigable terrain
+        if len(Rover.nav_angles) >= Rover.stop_forward:
+            # If mode is forward, navigable terrain looks good
+            # and velocity is below max, then throttle
+            if Rover.vel < Rover.max_vel:
+                # Set throttle value to throttle setting
+                Rover.throttle = Rover.throttle_set
+            else: # Else coast
+                Rover.throttle = 0
+            Rover.brake = 0
+            # Head for the next frontier when exploring
+            target = Rover.explorer.target(Rover.pos) if Rover.explorer is not None else None
+            if target is not None:
+                Rover.steer = steer_within_terrain(Rover, target)
+            else:
+                # Set steering to (average + 14) angle clipped to the range +/- 15
+                Rover.steer = np.clip(np.mean(Rover.nav_angles * 180/np.pi) + 14, -15, 15)
+            return None
+        # If there's a lack of navigable terrain pixels then go to 'stop' mode
+        # Set mode to "stop" and hit the brakes!
+        Rover.throttle = 0
+        # Set brake to stored brake value
+        Rover.brake = Rover.brake_set
+        Rover.steer = 0
+        return 'stop'
+
+
+# Define a class for what the rover does in stop mode: brake, then turn in place until there
+# is enough navigable terrain ahead to go forward.
+class StopMode():
+    guarded = True
+
+    def step(self, Rover):
+        # If we're in stop mode but still moving keep braking
+        if Rover.vel > 0.2:
+            Rover.throttle = 0
+            Rover.brake = Rover.brake_set
+            Rover.steer = 0
+            return None
+        # If we're not moving (vel < 0.2) then do something else
+        # Now we're stopped and we have vision data to see if there's a path forward
+        if len(Rover.nav_angles) < Rover.go_forward:
+            Rover.throttle = 0
+            # Release the brake to allow turning
+            Rover.brake = 0
+            # Turn range is +/- 15 degrees, when stopped the next line will induce 4-wheel turning
+            Rover.steer = -15 # Could be more clever here about which way to turn
+            return None
+        # If we're stopped but see sufficient navigable terrain in front then go!
+        # Set throttle back to stored value
+        Rover.throttle = Rover.throttle_set
+        # Release the brake
+        Rover.brake = 0
+        # Set steer to mean angle
+        Rover.steer = np.clip(np.mean(Rover.nav_angles * 180/np.pi), -15, 15)
+        return 'forward'
+
+
+# Define a class for what the rover does in pickup mode: approach the rock in view, or the
+# last position one was seen at, and pick it up.
+class PickupMode():
+    guarded = True
+
+    def step(self, Rover):
+        # If not picking up, send pickup.
+        if Rover.vel == 0 and not Rover.picking_up and Rover.near_sample:
+            Rover.send_pickup = True
+        if Rover.picking_up:  # Confirmed pickup, set mode to forward.
+            Rover.current_sample_pos = None
+            return 'forward'
+        # If we see the rock, go towards it.
+        if Rover.rock_angles is not None and len(Rover.rock_angles) > 1:
+            rock_distance = np.mean(Rover.rock_dists)
+            if Rover.near_sample:
+                Rover.throttle = 0
+                Rover.brake = Rover.brake_set
+                Rover.steer = 0
+            elif rock_distance < 15:
+                if Rover.vel < Rover.rock_approach_vel:
+                    Rover.throttle = Rover.throttle_crawl
+                    Rover.brake = 0
+                else:
+                    Rover.throttle = 0
+                    Rover.brake = 8
+                Rover.steer = np.clip(np.mean(Rover.rock_angles * 180/np.pi) - 10, -15, 15)
+            else:
+                if Rover.vel < Rover.rock_approach_vel:
+                    Rover.throttle = Rover.throttle_crawl
+                else:
+                    Rover.throttle = 0
+                    Rover.brake = 6
+                Rover.steer = np.clip(np.mean(Rover.rock_angles * 180/np.pi) - 10, -15, 15)
+                Rover.brake = 0
+            return None
+        if Rover.current_sample_pos is not None:
+            # We dont see the rock, but know its position, follow a planned path towards it to see it.
+            rock_distance = distance_between(Rover.current_sample_pos, Rover.pos)
+            if Rover.near_sample:
+                Rover.throttle = 0
+                Rover.brake = Rover.brake_set
+                Rover.steer = 0
+            elif rock_distance > 1:
+                waypoint = Rover.planner.next_waypoint(Rover.pos, Rover.current_sample_pos)
+                drive_towards(Rover, waypoint, Rover.throttle_crawl, Rover.rock_approach_vel)
+            else:
+                # We might have overshot, just keep moving although we should think about a way to go
+                # back and get it.
+                Rover.steer = 0
+                Rover.throttle = 0
+                Rover.brake = 0
+                return 'forward'
+            return None
+        Rover.brake = Rover.brake_set
+        Rover.steer = 0
+        Rover.throttle = 0
+        Rover.current_sample_pos = None
+        return 'forward'
+
+
+# Define a class for what the rover does in unstuck mode: turn in place until it faces
+# another way than the one it got stuck in.
+class UnstuckMode():
+    guarded = True
+
+    def step(self, Rover):
+        # Uh oh, we are stuck, rotate to find a way out.
+        Rover.throttle = 0
+        Rover.brake = 0
+        Rover.steer = - 15
+        if abs(Rover.yaw - Rover.stuck_yaw) > 10:
+            return 'stop'
+        return None
+
+
+# Define a class for what the rover does in home mode: follow a path planned over the
+# worldmap back to the starting position.
+class HomeMode():
+    guarded = True
+
+    def step(self, Rover):
+        # We are all done here, lets get home.
+        if Rover.distance_to_start < 1:
+            Rover.brake = Rover.brake_set
+            Rover.steer = 0
+            Rover.throttle = 0
+            return 'home_dance'
+        # Follow a path planned over the worldmap
+        waypoint = Rover.planner.next_waypoint(Rover.pos, Rover.start_pos)
+        drive_towards(Rover, waypoint, Rover.throttle_quarter, Rover.max_vel)
+        return None
 
-    # Implement conditionals to decide what to do given perception data
-    # Here you're all set up with some basic functionality but you'll need to
-    # improve on this decision tree to do a good job of navigating autonomously!
 
-    # We are home, lets dance.
-    if Rover.mode == 'home_dance':
+# Define a class for what the rover does once home: dance, forever.
+class HomeDanceMode():
+    guarded = False
+
+    def step(self, Rover):
         # We are home, lets dance
         if Rover.vel > 0:
             Rover.brake = Rover.brake_set
@@ -32,75 +201,157 @@ def decision_step(Rover):
             Rover.throttle = 0
             if Rover.dance_frames < 0:
                 Rover.increment = True
+        return None
+
+
+# Define a class deciding the throttle, brake and steer commands based on the output of the
+# perception_step() function, as a state machine over the modes of TRANSITIONS.
+# Every frame the guards (checks that can switch modes whatever the rover is doing, like a rock
+# coming into view or the rover getting stuck) run in order, each only in the modes it is
+# listed for, then the handler of the current mode. The inputs are kept on the Rover state,
+# and the number of mapped cells by the worldmap as it changes.
+# Transitions and the frames and time spent in each mode are counted for the profile report;
+# a transition missing from TRANSITIONS is logged. Modes set from outside (e.g. by a
+# benchmark) are taken as they are.
+class DecisionMachine():
+    def __init__(self):
+        self.handlers = {'forward': ForwardMode(), 'stop': StopMode(), 'pickup': PickupMode(),
+                         'unstuck': UnstuckMode(), 'home': HomeMode(), 'home_dance': HomeDanceMode()}
+        # (modes the guard runs in, guard), in the order they run
+        self.guards = [
+            (('forward', 'stop', 'unstuck', 'home'), self.rock_in_view),
+            (MODES, self.count_try_home),
+            (MODES, self.count_unstuck),
+            (MODES, self.count_low_forward),
+            (MODES, self.count_max_steer),
+            (MODES, self.check_home),
+        ]
+        self.mode = None
+        self.entered = None
+        # (from mode, to mode) -> number of transitions
+        self.transitions = {}
+        self.unexpected = 0
+        # Mode -> number of frames and seconds spent in it
+        self.frames = dict.fromkeys(MODES, 0)
+        self.seconds = dict.fromkeys(MODES, 0.0)
+
+    # Decide the commands for the current Rover state
+    def step(self, Rover):
+        self.enter(Rover.mode)
+        self.frames[Rover.mode] += 1
+        handler = self.handlers[Rover.mode]
+        if handler.guarded:
+            for modes, guard in self.guards:
+                if Rover.mode in modes:
+                    self.switch(Rover, guard(Rover))
+            # Check if we have vision data to make decisions with
+            if Rover.nav_angles is None:
+                # Just to make the rover do something
+                # even if no modifications have been made to the code
+                Rover.throttle = Rover.throttle_set
+                Rover.steer = 0
+                Rover.brake = 0
+                return Rover
+            self.switch(Rover, self.check_stuck(Rover))
+            handler = self.handlers[Rover.mode]
+        self.switch(Rover, handler.step(Rover))
         return Rover
-    
-    # Check if we have vision of a rock and make decisions
-    if Rover.rock_angles is not None and len(Rover.rock_angles) > 1:
-        # Begin stopping
-        if Rover.mode != 'pickup':
+
+    # Start timing a mode, if it is not the current one
+    def enter(self, mode):
+        if mode == self.mode:
+            return
+        now = time.perf_counter()
+        if self.mode is not None:
+            self.seconds[self.mode] += now - self.entered
+        self.mode = mode
+        self.entered = now
+
+    # Switch the Rover to a mode, None to stay in the current one
+    def switch(self, Rover, mode):
+        if mode is None or mode == Rover.mode:
+            return
+        key = (Rover.mode, mode)
+        if mode not in TRANSITIONS[Rover.mode]:
+            self.unexpected += 1
+            logger.warning("Unexpected mode transition from {} to {}".format(*key))
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        Rover.mode = mode
+        self.enter(mode)
+
+    # Check if we have vision of a rock and begin stopping
+    def rock_in_view(self, Rover):
+        if Rover.rock_angles is not None and len(Rover.rock_angles) > 1:
             Rover.throttle = 0
             Rover.brake = 3
             Rover.steer = 0
-            Rover.mode = 'pickup'
+            return 'pickup'
+        return None
 
     # We are getting unstuck going home.
-    if Rover.try_home_frames > 0:
-        Rover.try_home_frames -= 1
-        # We have tried to get unstuck for a while, try to get to home again.
-        if Rover.try_home_frames <= 0:
-            Rover.mode = 'home'
+    def count_try_home(self, Rover):
+        if Rover.try_home_frames > 0:
+            Rover.try_home_frames -= 1
+            # We have tried to get unstuck for a while, try to get to home again.
+            if Rover.try_home_frames <= 0:
+                return 'home'
+        return None
 
     # Some times the rover might get stuck in a corner with no way to go out, so reduce the number of forward pixels
     # to find a way out.
-    if Rover.mode == 'unstuck' or Rover.mode == 'stop':
-        Rover.unstuck_frames += 1
-        if Rover.unstuck_frames > 500:
-            Rover.go_forward = 100
-    else:
-        Rover.unstuck_frames = 0
+    def count_unstuck(self, Rover):
+        if Rover.mode == 'unstuck' or Rover.mode == 'stop':
+            Rover.unstuck_frames += 1
+            if Rover.unstuck_frames > 500:
+                Rover.go_forward = 100
+        else:
+            Rover.unstuck_frames = 0
+        return None
 
     # Reset the go_forward threshold.
-    if Rover.go_forward == 100:
-        Rover.low_forward_frames += 1
-        if Rover.low_forward_frames >= 500:
-            Rover.go_forward = 500
-    else:
-        Rover.low_forward_frames = 0
+    def count_low_forward(self, Rover):
+        if Rover.go_forward == 100:
+            Rover.low_forward_frames += 1
+            if Rover.low_forward_frames >= 500:
+                Rover.go_forward = 500
+        else:
+            Rover.low_forward_frames = 0
+        return None
 
     # The Rover might go in circles when in a wide open area, this is to safe guard against that.
-    if Rover.mode == 'forward' \
-            and not Rover.picking_up \
-            and (Rover.steer > 13.5 or Rover.steer < -13.5) \
-            and Rover.vel > 0.2:
-        Rover.max_steer_frames += 1
-        if Rover.max_steer_frames > 500:
-            Rover.mode = 'unstuck'
-            Rover.brake = 0
-            Rover.steer = 0
-            Rover.throttle = 0
-            Rover.stuck_yaw = Rover.yaw
-    else:
-        Rover.max_steer_frames = 0
+    def count_max_steer(self, Rover):
+        if Rover.mode == 'forward' \
+                and not Rover.picking_up \
+                and (Rover.steer > 13.5 or Rover.steer < -13.5) \
+                and Rover.vel > 0.2:
+            Rover.max_steer_frames += 1
+            if Rover.max_steer_frames > 500:
+                Rover.brake = 0
+                Rover.steer = 0
+                Rover.throttle = 0
+                Rover.stuck_yaw = Rover.yaw
+                return 'unstuck'
+        else:
+            Rover.max_steer_frames = 0
+        return None
 
-    # Set the starting position.
-    if Rover.start_pos is None:
-        Rover.start_pos = Rover.pos
-        Rover.recover_pos = Rover.pos
-        Rover.recover_yaw = Rover.yaw
-    else:
-        #  Check if we are near the start.
+    # Set the starting position, or check if we are back near it with most of the map explored
+    def check_home(self, Rover):
+        if Rover.start_pos is None:
+            Rover.start_pos = Rover.pos
+            Rover.recover_pos = Rover.pos
+            Rover.recover_yaw = Rover.yaw
+            return None
         distance_to_start = distance_between(Rover.pos, Rover.start_pos)
         Rover.distance_to_start = distance_to_start
-        map_filled = np.count_nonzero(Rover.worldmap)
-        if not Rover.mode == 'unstuck' and map_filled > 7000 and distance_to_start < 5:
+        if not Rover.mode == 'unstuck' and distance_to_start < 5 \
+                and Rover.worldmap.count_nonzero() > 7000 * Rover.worldmap.resolution ** 2:
             Rover.ready_for_home = True
             if Rover.try_home_frames <= 0:
-                Rover.mode = 'home'
-
-    # Example:
-    # Check if we have vision data to make decisions with
-    if Rover.nav_angles is not None:
+                return 'home'
+        return None
 
+    def check_stuck(self, Rover):
         if is_stuck(Rover):
             Rover.stuck_frames += 1
             if Rover.stuck_frames > 50:
@@ -108,216 +359,77 @@ def decision_step(Rover):
                 Rover.brake = 0
                 Rover.steer = 0
                 Rover.stuck_yaw = Rover.yaw
-                Rover.mode = 'unstuck'
                 if Rover.ready_for_home:
                     Rover.try_home_frames = 500
+                return 'unstuck'
         else:
             Rover.stuck_frames = 0
+        return None
 
-        # Check for Rover.mode status
-        if Rover.mode == 'forward':
-            # Check the extent of navigable terrain
-            if len(Rover.nav_angles) >= Rover.stop_forward:  
-                # If mode is forward, navigable terrain looks good 
-                # and velocity is below max, then throttle 
-                if Rover.vel < Rover.max_vel:
-                    # Set throttle value to throttle setting
-                    Rover.throttle = Rover.throttle_set
-                else: # Else coast
-                    Rover.throttle = 0
-                Rover.brake = 0
-                # Set steering to (average + 14) angle clipped to the range +/- 15
-                Rover.steer = np.clip(np.mean(Rover.nav_angles * 180/np.pi) + 14, -15, 15)
-            # If there's a lack of navigable terrain pixels then go to 'stop' mode
-            elif len(Rover.nav_angles) < Rover.stop_forward:
-                    # Set mode to "stop" and hit the brakes!
-                    Rover.throttle = 0
-                    # Set brake to stored brake value
-                    Rover.brake = Rover.brake_set
-                    Rover.steer = 0
-                    Rover.mode = 'stop'
-
-        # If we're already in "stop" mode then make different decisions
-        elif Rover.mode == 'stop':
-            # If we're in stop mode but still moving keep braking
-            if Rover.vel > 0.2:
-                Rover.throttle = 0
-                Rover.brake = Rover.brake_set
-                Rover.steer = 0
-            # If we're not moving (vel < 0.2) then do something else
-            elif Rover.vel <= 0.2:
-                # Now we're stopped and we have vision data to see if there's a path forward
-                if len(Rover.nav_angles) < Rover.go_forward:
-                    Rover.throttle = 0
-                    # Release the brake to allow turning
-                    Rover.brake = 0
-                    # Turn range is +/- 15 degrees, when stopped the next line will induce 4-wheel turning
-                    Rover.steer = -15 # Could be more clever here about which way to turn
-                # If we're stopped but see sufficient navigable terrain in front then go!
-                if len(Rover.nav_angles) >= Rover.go_forward:
-                    # Set throttle back to stored value
-                    Rover.throttle = Rover.throttle_set
-                    # Release the brake
-                    Rover.brake = 0
-                    # Set steer to mean angle
-                    Rover.steer = np.clip(np.mean(Rover.nav_angles * 180/np.pi), -15, 15)
-                    Rover.mode = 'forward'
-        elif Rover.mode == 'pickup':
-            # If not picking up, send pickup.
-            if Rover.vel == 0 and not Rover.picking_up and Rover.near_sample:
-                Rover.send_pickup = True
-            if Rover.picking_up:  # Confirmed pickup, set mode to forward.
-                Rover.mode = 'forward'
-                Rover.current_sample_pos = None
-            else:
-                # If we see the rock, go towards it.
-                if Rover.rock_angles is not None and len(Rover.rock_angles) > 1:
-                    rock_distance = np.mean(Rover.rock_dists)
-                    if Rover.near_sample:
-                        Rover.throttle = 0
-                        Rover.brake = Rover.brake_set
-                        Rover.steer = 0
-                    elif rock_distance < 15:
-                        if Rover.vel < Rover.rock_approach_vel:
-                            Rover.throttle = Rover.throttle_crawl
-                            Rover.brake = 0
-                        else:
-                            Rover.throttle = 0
-                            Rover.brake = 8
-                        Rover.steer = np.clip(np.mean(Rover.rock_angles * 180/np.pi) - 10, -15, 15)
-                    else:
-                        if Rover.vel < Rover.rock_approach_vel:
-                            Rover.throttle = Rover.throttle_crawl
-                        else:
-                            Rover.throttle = 0
-                            Rover.brake = 6
-                        Rover.steer = np.clip(np.mean(Rover.rock_angles * 180/np.pi) - 10, -15, 15)
-                        Rover.brake = 0
-                elif Rover.current_sample_pos is not None:
-                    # We dont see the rock, but know its position, turn towards it to see it.
-                    rock_distance = distance_between(Rover.current_sample_pos, Rover.pos)
-                    target_yaw = np.arctan2(int(Rover.current_sample_pos[1]) - (int(Rover.pos[1])),
-                                    int(Rover.current_sample_pos[0]) - (int(Rover.pos[0])))
-                    if target_yaw < 0:
-                        target_yaw += np.pi * 2
-
-                    target_yaw = target_yaw * 180/np.pi
-                    if Rover.near_sample:
-                        Rover.throttle = 0
-                        Rover.brake = Rover.brake_set
-                        Rover.steer = 0
-                    elif abs(target_yaw - Rover.yaw) <= 5 or abs(target_yaw - Rover.yaw) >= 255:
-                        if rock_distance < 10:
-                            if Rover.vel < Rover.rock_approach_vel:
-                                Rover.throttle = Rover.throttle_crawl
-                                Rover.brake = 0
-                            else:
-                                Rover.throttle = 0
-                                Rover.brake = 8
-                            Rover.steer = 0
-                        else:
-                            if Rover.vel < Rover.rock_approach_vel:
-                                Rover.throttle = Rover.throttle_crawl
-                                Rover.brake = 0
-                            else:
-                                Rover.throttle = 0
-                                Rover.brake = 6
-                            Rover.steer = 0
-                    elif rock_distance > 1:
-                        if Rover.vel > 0:
-                            Rover.steer = 0
-                            Rover.throttle = 0
-                            Rover.brake = Rover.brake_set
-                        else:
-                            if abs(Rover.yaw - target_yaw) > 180:
-                                if target_yaw - Rover.yaw < 0:
-                                    Rover.steer = 2
-                                else:
-                                    Rover.steer = -2
-                            else:
-                                if target_yaw - Rover.yaw < 0:
-                                    Rover.steer = -2
-                                else:
-                                    Rover.steer = 2
-                            Rover.throttle = 0
-                            Rover.brake = Rover.brake = 0
-                    else:
-                        # We might have overshot, just keep moving although we should think about a way to go
-                        # back and get it.
-                        Rover.steer = 0
-                        Rover.throttle = 0
-                        Rover.brake = 0
-                        Rover.mode = 'forward'
-                else:
-                    Rover.brake = Rover.brake_set
-                    Rover.steer = 0
-                    Rover.throttle = 0
-                    Rover.current_sample_pos = None
-                    Rover.mode = 'forward'
-        elif Rover.mode == 'unstuck':
-            # Uh oh, we are stuck, rotate to find a way out.
-            Rover.throttle = 0
-            Rover.brake = 0
-            Rover.steer = - 15
-            if abs(Rover.yaw - Rover.stuck_yaw) > 10:
-                Rover.mode = 'stop'
-        elif Rover.mode == 'home':
-            # We are all done here, lets get home.
-            target_yaw = np.arctan2(int(Rover.start_pos[1]) - (int(Rover.pos[1])),
-                                    int(Rover.start_pos[0]) - (int(Rover.pos[0])))
-            if target_yaw < 0:
-                target_yaw += np.pi * 2
-
-            target_yaw = target_yaw * 180/np.pi
-
-            yaw_diff = target_yaw - Rover.yaw
-
-            # We are almost looking at the destination, go towards it.
-            if abs(yaw_diff) <= 5 or abs(yaw_diff) >= 355:
-                # Move towards target
-                if Rover.distance_to_start < 1:
-                    Rover.brake = Rover.brake_set
-                    Rover.steer = 0
-                    Rover.throttle = 0
-                    Rover.mode = 'home_dance'
-                else:
-                    Rover.steer = 0
-                    Rover.brake = 0
-                    Rover.throttle = Rover.throttle_quarter
-            else:
-                # Stop and turn towards the target.
-                if Rover.vel > 0:
-                    Rover.steer = 0
-                    Rover.throttle = 0
-                    Rover.brake = Rover.brake_set
-                else:
-                    if abs(yaw_diff) > 180:
-                        if yaw_diff < 0:
-                            Rover.steer = 2
-                        else:
-                            Rover.steer = -2
-                    else:
-                        if yaw_diff < 0:
-                            Rover.steer = -2
-                        else:
-                            Rover.steer = 2
-                    Rover.throttle = 0
-                    Rover.brake = Rover.brake = 0
+    # Return the mode report as a list of lines
+    def report(self):
+        lines = ['{:<12} {:>8} {:>10}'.format('mode', 'frames', 'seconds')]
+        for mode in MODES:
+            seconds = self.seconds[mode]
+            if mode == self.mode:
+                seconds += time.perf_counter() - self.entered
+            lines.append('{:<12} {:>8} {:>10.1f}'.format(mode, self.frames[mode], seconds))
+        for (source, target), count in sorted(self.transitions.items()):
+            lines.append('{} -> {}: {}'.format(source, target, count))
+        if self.unexpected > 0:
+            lines.append('{} unexpected transitions'.format(self.unexpected))
+        return lines
 
-    # Just to make the rover do something 
-    # even if no modifications have been made to the code
-    else:
-        Rover.throttle = Rover.throttle_set
-        Rover.steer = 0
-        Rover.brake = 0
-        
-    # # If in a state where want to pickup a rock send pickup command
-    # if Rover.near_sample and Rover.vel == 0 and not Rover.picking_up:
-    #     Rover.send_pickup = True
-    
-    return Rover
+    # Write the mode report to the log
+    def dump(self):
+        if sum(self.frames.values()) == 0:
+            return
+        for line in self.report():
+            logger.info(line)
+
+
+# Decides the commands of every frame, keeping count of the modes for the profile report
+decision_machine = DecisionMachine()
+
+
+# This is where you can build a decision tree for determining throttle, brake and steer
+# commands based on the output of the perception_step() function
+def decision_step(Rover):
+    return decision_machine.step(Rover)
 
 
 # Checks if the rover is stuck.
 def is_stuck(Rover):
     return not Rover.picking_up and Rover.vel < 0.1 and Rover.throttle != 0
+
+
+# Drive towards a target position: steer towards it while roughly facing it, otherwise stop
+# and turn in place towards it.
+def drive_towards(Rover, target, throttle, max_vel, max_yaw_diff=20):
+    target_yaw = np.arctan2(target[1] - Rover.pos[1], target[0] - Rover.pos[0]) * 180/np.pi
+    # Angle to turn, in the range -180 to 180 degrees
+    yaw_diff = (target_yaw - Rover.yaw + 180) % 360 - 180
+    if abs(yaw_diff) <= max_yaw_diff:
+        Rover.steer = np.clip(yaw_diff, -15, 15)
+        Rover.brake = 0
+        Rover.throttle = throttle if Rover.vel < max_vel else 0
+    elif Rover.vel > 0.2:
+        # Stop before turning in place
+        Rover.steer = 0
+        Rover.throttle = 0
+        Rover.brake = Rover.brake_set
+    else:
+        Rover.throttle = 0
+        Rover.brake = 0
+        Rover.steer = 15 if yaw_diff > 0 else -15
+
+
+# Return the steering angle towards a target position, kept within the directions of the
+# navigable terrain in view so the rover steers around what is in front of it.
+def steer_within_terrain(Rover, target):
+    target_yaw = np.arctan2(target[1] - Rover.pos[1], target[0] - Rover.pos[0]) * 180/np.pi
+    yaw_diff = (target_yaw - Rover.yaw + 180) % 360 - 180
+    nav_angles = Rover.nav_angles * 180/np.pi
+    low, high = np.percentile(nav_angles, [10, 90])
+    return np.clip(np.clip(yaw_diff, low, high), -15, 15)
+
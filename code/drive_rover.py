@@ -2,7 +2,6 @@
 import argparse
 import shutil
 import base64
-from datetime import datetime
 import os
 import cv2
 import numpy as np
@@ -14,103 +13,41 @@ from flask import Flask
 from io import BytesIO, StringIO
 import json
 import pickle
-import matplotlib.image as mpimg
 import time
+import logging
+import atexit
+import signal
 
 # Import functions for perception and decision making
 from perception import perception_step
-from decision import decision_step
-from supporting_functions import update_rover, create_output_images,distance_between
+from decision import decision_step, decision_machine
+from supporting_functions import update_rover, distance_between, logger
+from rover_state import RoverState
+from hud import HudRenderer
+from recorder import FrameRecorder
+from profiler import StageProfiler
+from scheduler import PerceptionScheduler
+from pipeline import PerceptionPipeline
+from frontier import FrontierExplorer
 # Initialize socketio server and Flask application 
 # (learn more at: https://python-socketio.readthedocs.io/en/latest/)
 sio = socketio.Server()
 app = Flask(__name__)
 
-# Read in ground truth map and create 3-channel green version for overplotting
-# NOTE: images are read in by default with the origin (0, 0) in the upper left
-# and y-axis increasing downward.
-ground_truth = mpimg.imread('../calibration_images/map_bw.png')
-# This next line creates arrays of zeros in the red and blue channels
-# and puts the map into the green channel.  This is why the underlying 
-# map output looks green in the display image
-ground_truth_3d = np.dstack((ground_truth*0, ground_truth*255, ground_truth*0)).astype(np.float)
-
-# Define RoverState() class to retain rover state parameters
-class RoverState():
-    def __init__(self):
-        self.start_time = None # To record the start time of navigation
-        self.start_pos = None
-        self.total_time = None # To record total duration of naviagation
-        self.img = None # Current camera image
-        self.pos = None # Current position (x, y)
-        self.yaw = None # Current yaw angle
-        self.pitch = None # Current pitch angle
-        self.roll = None # Current roll angle
-        self.vel = None # Current velocity
-        self.steer = 0 # Current steering angle
-        self.throttle = 0 # Current throttle value
-        self.brake = 0 # Current brake value
-        self.nav_angles = None # Angles of navigable terrain pixels
-        self.nav_dists = None # Distances of navigable terrain pixels
-        
-        ####
-        self.rock_angles = None # Angles of rock object
-        self.rock_dists = None # Distances of rock object
-        ####
-
-        self.stuck_yaw = None
-        
-        self.ground_truth = ground_truth_3d # Ground truth worldmap
-        self.mode = 'forward' # Current mode (can be forward or stop), need other modes?
-        self.throttle_set = 0.35 # Throttle setting when accelerating
-        self.throttle_one_eighth = 0.125
-        self.throttle_quarter = 0.25
-        self.throttle_three_quarters = 0.75
-        self.throttle_crawl = 0.15
-        self.throttle_full = 1.0
-        self.brake_set = 10 # Brake setting when braking
-        # The stop_forward and go_forward fields below represent total count
-        # of navigable terrain pixels.  This is a very crude form of knowing
-        # when you can keep going and when you should stop.  Feel free to
-        # get creative in adding new fields or modifying these!
-        self.stop_forward = 50 # Threshold to initiate stopping
-        self.go_forward = 500 # Threshold to go forward again
-        self.max_vel = 1.6 # Maximum velocity (meters/second)
-        self.rock_approach_vel = 0.5
-        # Image output from perception step
-        # Update this image to display your intermediate analysis steps
-        # on screen in autonomous mode
-        self.vision_image = np.zeros((160, 320, 3), dtype=np.float) 
-        # Worldmap
-        # Update this image with the positions of navigable terrain
-        # obstacles and rock samples
-        self.worldmap = np.zeros((200, 200, 3), dtype=np.float) 
-        self.samples_pos = None # To store the actual sample positions
-        self.current_sample_pos = None # To store the position of the sample currently being collected
-        self.samples_to_find = 0 # To store the initial count of samples
-        self.samples_found = 0 # To count the number of samples found
-        self.near_sample = 0 # Will be set to telemetry value data["near_sample"]
-        self.picking_up = 0 # Will be set to telemetry value data["picking_up"]
-        self.send_pickup = False # Set to True to trigger rock pickup
-
-        self.stuck_frames = 0  # Number of frames the rover is stuck.
-        self.unstuck_frames = 0  # Number of frames the rover is in circling pattern
-        self.low_forward_frames = 0  # Number of frames the rover is
-        self.zero_vel_frames = 0
-        self.max_steer_frames = 0
-        self.try_home_frames = 0
-        self.dance_frames = 0
-        self.increment = True
-        self.distance_to_start = 0
-
-        self.ready_for_home = False
-
-        self.recover_yaw = None
-        self.recover_pos = None
-
-
 # Initialize our rover
 Rover = RoverState()
+# Draws the inset images, configured from the command line
+hud = HudRenderer()
+# Records the run if an image folder is given on the command line
+recorder = None
+# Decides how much perception work each frame gets, if adaptive perception is enabled
+scheduler = None
+# Decodes camera images and runs perception on a worker thread, in pipelined mode
+pipeline = None
+# Factor the bird's-eye grid of perception is downsampled by
+downsample = 1
+# Times each stage of the telemetry loop, the latency report is logged on SIGUSR1 and at shutdown
+profiler = StageProfiler()
 
 # Variables to track frames per second (FPS)
 # Intitialize frame counter
@@ -118,33 +55,51 @@ frame_counter = 0
 # Initalize second counter
 second_counter = time.time()
 fps = None
+# Seconds between latency reports, 0 to only log them on demand and at shutdown
+profile_interval = 0
+last_profile_dump = time.time()
 
 
 # Define telemetry function for what to do with incoming data
 @sio.on('telemetry')
 def telemetry(sid, data):
-    global frame_counter, second_counter, fps
+    global frame_counter, second_counter, fps, last_profile_dump
     frame_counter += 1
     # Do a rough calculation of frames per second (FPS)
     if (time.time() - second_counter) > 1:
         fps = frame_counter
         frame_counter = 0
         second_counter = time.time()
-    print("Current FPS: {}".format(fps))
+        logger.info("Current FPS: {}".format(fps))
+        if profile_interval > 0 and second_counter - last_profile_dump >= profile_interval:
+            last_profile_dump = second_counter
+            dump_profile()
 
     if data:
         global Rover
         # Initialize / update Rover with current telemetry
-        Rover, image = update_rover(Rover, data)
+        # In pipelined mode the camera image is decoded by the pipeline's worker
+        with profiler.stage('decode'):
+            Rover, image = update_rover(Rover, data, decode_image=pipeline is None)
 
         if np.isfinite(Rover.vel):
 
             # Execute the perception and decision steps to update the Rover's state
-            Rover = perception_step(Rover)
-            Rover = decision_step(Rover)
-
-            # Create output images to send to server
-            out_image_string1, out_image_string2 = create_output_images(Rover)
+            with profiler.stage('perception'):
+                if pipeline is not None:
+                    # Queue this frame and decide with the freshest results available
+                    pipeline.submit(data["image"], Rover)
+                    pipeline.apply(Rover)
+                elif scheduler is not None:
+                    Rover = scheduler.step(Rover)
+                else:
+                    Rover = perception_step(Rover, downsample=downsample)
+            with profiler.stage('decision'):
+                Rover = decision_step(Rover)
+
+            # Create output images to send to server (or reuse the latest ones)
+            with profiler.stage('render'):
+                out_image_string1, out_image_string2 = hud.update(Rover)
 
             # The action step!  Send commands to the rover!
 
@@ -152,29 +107,37 @@ def telemetry(sid, data):
             # to send back new telemetry so we must only send one
             # back in respose to the current telemetry data.
 
-            # If in a state where want to pickup a rock send pickup command
-            if Rover.send_pickup and not Rover.picking_up:
-                send_pickup()
-                # Reset Rover flags
-                Rover.send_pickup = False
-            else:
-                # Send commands to the rover!
-                commands = (Rover.throttle, Rover.brake, Rover.steer)
-                send_control(commands, out_image_string1, out_image_string2)
+            with profiler.stage('send'):
+                # If in a state where want to pickup a rock send pickup command
+                if Rover.send_pickup and not Rover.picking_up:
+                    send_pickup()
+                    # Reset Rover flags
+                    Rover.send_pickup = False
+                else:
+                    # Send commands to the rover!
+                    commands = (Rover.throttle, Rover.brake, Rover.steer)
+                    send_control(commands, out_image_string1, out_image_string2)
 
         # In case of invalid telemetry, send null commands
         else:
 
             # Send zeros for throttle, brake and steer and empty images
-            send_control((0, 0, 0), '', '')
+            with profiler.stage('send'):
+                send_control((0, 0, 0), '', '')
 
         # If you want to save camera images from autonomous driving specify a path
         # Example: $ python drive_rover.py image_folder_path
         # Conditional to save image frame if folder was specified
-        if args.image_folder != '':
-            timestamp = datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f')[:-3]
-            image_filename = os.path.join(args.image_folder, timestamp)
-            image.save('{}.jpg'.format(image_filename))
+        # Frames are written in the background by the recorder
+        # In pipelined mode every frame is recorded as the JPEG received, not only the frames
+        # the pipeline's worker gets to decode
+        if recorder is not None:
+            with profiler.stage('record'):
+                if image is not None:
+                    recorder.record(image, Rover)
+                else:
+                    recorder.record_encoded(data["image"], Rover)
+        profiler.end_frame()
 
     else:
         sio.emit('manual', data={}, skip_sid=True)
@@ -210,7 +173,7 @@ def send_control(commands, image_string1, image_string2):
 
 # Define a function to send the "pickup" command
 def send_pickup():
-    print("Picking up")
+    logger.info("Picking up")
     pickup = {}
     sio.emit(
         "pickup",
@@ -219,6 +182,24 @@ def send_pickup():
     eventlet.sleep(0)
 
 
+# Define a function to log the latency and decision mode reports, as a signal handler or at shutdown
+def dump_profile(*args):
+    profiler.dump()
+    decision_machine.dump()
+
+
+# Define a function to stop the perception worker when shutting down
+def stop_pipeline():
+    pipeline.stop()
+    logger.info("Pipeline perceived {} of {} frames".format(pipeline.perceived, pipeline.submitted))
+
+
+# Define a function to write out the frames still queued when shutting down
+def close_recorder():
+    recorder.close()
+    logger.info("Recorded {} frames, dropped {}".format(recorder.recorded, recorder.dropped))
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Remote Driving')
     parser.add_argument(
@@ -226,10 +207,108 @@ if __name__ == '__main__':
         type=str,
         nargs='?',
         default='',
-        help='Path to image folder. This is where the images from the run will be saved.'
+        help='Path to image folder. This is where the images (in IMG) and telemetry log (robot_log.csv) from the run will be saved.'
+    )
+    parser.add_argument(
+        '--hud-rate',
+        type=float,
+        default=0,
+        help='Rate (Hz) at which the inset images are redrawn, 0 to redraw them every frame.'
+    )
+    parser.add_argument(
+        '--hud-thread',
+        action='store_true',
+        help='Draw the inset images on a worker thread.'
+    )
+    parser.add_argument(
+        '--headless',
+        action='store_true',
+        help='Do not draw the inset images, send empty ones.'
+    )
+    parser.add_argument(
+        '--log-level',
+        type=str,
+        default='INFO',
+        help='Console log level, DEBUG prints the telemetry of every frame.'
+    )
+    parser.add_argument(
+        '--frame-budget',
+        type=float,
+        default=50,
+        help='Frame time budget (ms), frames taking longer are counted against their slowest stage.'
+    )
+    parser.add_argument(
+        '--profile-interval',
+        type=float,
+        default=0,
+        help='Log the stage latency report every this many seconds, 0 to only log it on SIGUSR1 and at shutdown.'
+    )
+    parser.add_argument(
+        '--adaptive-perception',
+        action='store_true',
+        help='Reuse the last perception results while the rover stands still and run reduced passes in home_dance mode.'
+    )
+    parser.add_argument(
+        '--perception-budget',
+        type=float,
+        default=0,
+        help='With adaptive perception, run reduced passes while perception takes longer than this (ms), 0 to never.'
+    )
+    parser.add_argument(
+        '--downsample',
+        type=int,
+        default=1,
+        help="Warp the camera image to a bird's-eye grid this many times smaller in each direction, for slow hosts."
+    )
+    parser.add_argument(
+        '--map-resolution',
+        type=int,
+        default=1,
+        help='Worldmap cells per meter, e.g. 4 for 0.25 m cells.'
+    )
+    parser.add_argument(
+        '--map-extent',
+        type=int,
+        default=200,
+        help='Meters covered by each side of the worldmap.'
+    )
+    parser.add_argument(
+        '--map-dtype',
+        type=str,
+        default='uint32',
+        choices=['uint16', 'uint32'],
+        help='Type of the worldmap detection counts, they saturate at its maximum.'
+    )
+    parser.add_argument(
+        '--explore',
+        action='store_true',
+        help='Head for the unexplored frontiers of the worldmap instead of hugging the left wall.'
+    )
+    parser.add_argument(
+        '--pipeline',
+        action='store_true',
+        help='Decode camera images and run perception on a worker thread, and draw the inset images on another.'
     )
     args = parser.parse_args()
 
+    logging.basicConfig(level=args.log_level.upper(), format='%(message)s')
+
+    profiler = StageProfiler(budget=args.frame_budget / 1000.0)
+    downsample = args.downsample
+    Rover = RoverState(map_resolution=args.map_resolution, map_extent=args.map_extent,
+                       map_dtype=np.dtype(args.map_dtype))
+    if args.explore:
+        Rover.explorer = FrontierExplorer(Rover.worldmap)
+    if args.adaptive_perception:
+        scheduler = PerceptionScheduler(budget=args.perception_budget / 1000.0, downsample=downsample)
+    profile_interval = args.profile_interval
+    atexit.register(dump_profile)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, dump_profile)
+
+    # In pipelined mode the inset images are always drawn on a worker thread
+    hud = HudRenderer(args.hud_rate, args.hud_thread or args.pipeline, args.headless)
+
     # os.system('rm -rf IMG_stream/*')
     if args.image_folder != '':
         print("Creating image folder at {}".format(args.image_folder))
@@ -238,10 +317,16 @@ if __name__ == '__main__':
         else:
             shutil.rmtree(args.image_folder)
             os.makedirs(args.image_folder)
+        recorder = FrameRecorder(args.image_folder)
+        atexit.register(close_recorder)
         print("Recording this run ...")
     else:
         print("NOT recording this run ...")
 
+    if args.pipeline:
+        pipeline = PerceptionPipeline(Rover, downsample, scheduler)
+        atexit.register(stop_pipeline)
+
     # wrap Flask application with socketio's middleware
     app = socketio.Middleware(sio, app)
 
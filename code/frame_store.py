@@ -0,0 +1,137 @@
+import argparse
+import csv
+import os
+
+import cv2
+import numpy as np
+
+from supporting_functions import convert_to_float
+
+# Fields of a logged frame, stored as a structured array in a frame store
+telemetry_dtype = np.dtype([('steer', np.float64), ('throttle', np.float64), ('brake', np.float64),
+                            ('vel', np.float64), ('x', np.float64), ('y', np.float64),
+                            ('pitch', np.float64), ('yaw', np.float64), ('roll', np.float64)])
+
+# Define a function to read the telemetry log of a recorded run.
+# Returns a list of dictionaries, one per frame, with the image path resolved to the
+# dataset's IMG folder (the logged paths are absolute paths on the recording machine).
+def read_log(dataset_folder):
+    frames = []
+    with open(os.path.join(dataset_folder, 'robot_log.csv')) as log_file:
+        for row in csv.DictReader(log_file, delimiter=';'):
+            filename = row['Path'].replace('\\', '/').split('/')[-1]
+            frames.append({
+                'path': os.path.join(dataset_folder, 'IMG', filename),
+                'steer': convert_to_float(row['SteerAngle']),
+                'throttle': convert_to_float(row['Throttle']),
+                'brake': convert_to_float(row['Brake']),
+                'vel': convert_to_float(row['Speed']),
+                'pos': [convert_to_float(row['X_Position']), convert_to_float(row['Y_Position'])],
+                'pitch': convert_to_float(row['Pitch']),
+                'yaw': convert_to_float(row['Yaw']),
+                'roll': convert_to_float(row['Roll']),
+            })
+    return frames
+
+# Define a function to read a recorded camera frame as RGB, the way the simulator sends it
+def load_image(path):
+    return cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+
+# Define a class to read a recorded run from its telemetry log and JPEG frames
+class DatasetRun():
+    def __init__(self, folder):
+        self.folder = folder
+        self.frames = read_log(folder)
+
+    def __len__(self):
+        return len(self.frames)
+
+    # Logged telemetry of a frame
+    def telemetry(self, idx):
+        return self.frames[idx]
+
+    # Camera image of a frame
+    def image(self, idx):
+        return load_image(self.frames[idx]['path'])
+
+    # Camera images of frames start to stop, stacked into one array
+    def images(self, start, stop):
+        return np.stack([self.image(idx) for idx in range(start, stop)])
+
+    # Logged x, y, yaw, pitch and roll of frames start to stop, as perception_batch takes them
+    def poses(self, start, stop):
+        return np.array([frame['pos'] + [frame['yaw'], frame['pitch'], frame['roll']]
+                         for frame in self.frames[start:stop]])
+
+# Define a class to read a run packed by pack_dataset.
+# The frames are a single memory-mapped uint8 array of shape (N, rows, cols, 3), so images
+# are returned as read-only views without any decoding or file opening.
+class FrameStore():
+    def __init__(self, folder):
+        self.folder = folder
+        self.frames = np.load(os.path.join(folder, 'frames.npy'), mmap_mode='r')
+        self.records = np.load(os.path.join(folder, 'telemetry.npy'))
+
+    def __len__(self):
+        return len(self.records)
+
+    # Logged telemetry of a frame, in the same form as read_log returns it
+    def telemetry(self, idx):
+        record = self.records[idx]
+        return {
+            'steer': float(record['steer']),
+            'throttle': float(record['throttle']),
+            'brake': float(record['brake']),
+            'vel': float(record['vel']),
+            'pos': [float(record['x']), float(record['y'])],
+            'pitch': float(record['pitch']),
+            'yaw': float(record['yaw']),
+            'roll': float(record['roll']),
+        }
+
+    # Camera image of a frame
+    def image(self, idx):
+        return self.frames[idx]
+
+    # Camera images of frames start to stop, a view of the memory-mapped frames
+    def images(self, start, stop):
+        return self.frames[start:stop]
+
+    # Logged x, y, yaw, pitch and roll of frames start to stop, as perception_batch takes them
+    def poses(self, start, stop):
+        records = self.records[start:stop]
+        return np.stack([records['x'], records['y'], records['yaw'], records['pitch'], records['roll']], axis=1)
+
+# Define a function to pack a recorded run into a frame store, written to the run's folder
+# unless another one is given
+def pack_dataset(dataset_folder, output_folder=None):
+    if output_folder is None:
+        output_folder = dataset_folder
+    frames = read_log(dataset_folder)
+    shape = load_image(frames[0]['path']).shape
+    images = np.lib.format.open_memmap(os.path.join(output_folder, 'frames.npy'), mode='w+',
+                                       dtype=np.uint8, shape=(len(frames),) + shape)
+    records = np.zeros(len(frames), dtype=telemetry_dtype)
+    for idx, frame in enumerate(frames):
+        images[idx] = load_image(frame['path'])
+        records[idx] = (frame['steer'], frame['throttle'], frame['brake'], frame['vel'],
+                        frame['pos'][0], frame['pos'][1], frame['pitch'], frame['yaw'], frame['roll'])
+    images.flush()
+    np.save(os.path.join(output_folder, 'telemetry.npy'), records)
+    return FrameStore(output_folder)
+
+# Define a function to open a recorded run, from its frame store if it has been packed
+def open_run(folder):
+    if os.path.exists(os.path.join(folder, 'frames.npy')):
+        return FrameStore(folder)
+    return DatasetRun(folder)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack a recorded run into a memory-mapped frame store')
+    parser.add_argument('dataset', type=str, help='Folder with the robot_log.csv and IMG folder of a recorded run.')
+    parser.add_argument('--output', type=str, default=None, help='Folder to write the frame store to.')
+    args = parser.parse_args()
+
+    store = pack_dataset(args.dataset, args.output)
+    print('Packed {} frames of shape {} into {}'.format(len(store), store.frames.shape[1:], store.folder))
@@ -0,0 +1,109 @@
+import cv2
+import numpy as np
+
+from planner import GridPlanner
+
+# Moves to the 4 neighbors of a cell: (dy, dx)
+NEIGHBORS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+# Define a class choosing where to explore next from the worldmap.
+# Frontier cells are cells seen navigable next to a cell without any detections. They are
+# kept up to date as a WorldMap listener, looking only at the cells that changed and their
+# neighbors. The goal is the frontier cell at least min_distance cells away with the lowest
+# distance minus gain_weight times the number of frontier cells around it (unexplored area
+# it opens up), and is reached with a GridPlanner. A goal is dropped when it is reached or
+# no longer a frontier, and given up on (never picked again) if not reached in
+# give_up_frames frames. Distances are in meters, gain_radius included, whatever the
+# resolution of the worldmap, and the gain is counted in meters of frontier. Giving up on a
+# goal gives up on the whole square meter it is in, so a finer map does not pick the cell
+# next to it instead.
+class FrontierExplorer():
+    def __init__(self, worldmap, min_distance=5, gain_radius=3, gain_weight=0.5, reach=3.0,
+                 give_up_frames=400):
+        self.worldmap = worldmap
+        self.size = worldmap.size
+        self.resolution = worldmap.resolution
+        self.min_distance = min_distance
+        self.gain_radius = gain_radius
+        self.gain_weight = gain_weight
+        self.reach = reach
+        self.give_up_frames = give_up_frames
+        # Flat masks of the frontier cells and of the cells given up on
+        self.frontier = np.zeros(self.size * self.size, dtype=bool)
+        self.given_up = np.zeros(self.size * self.size, dtype=bool)
+        self.planner = GridPlanner(worldmap)
+        self.goal = None
+        self.goal_cell = None
+        self.goal_frames = 0
+        # Counters
+        self.goals = 0
+        self.goals_given_up = 0
+        worldmap.add_listener(self.update)
+        self.refresh(np.arange(self.size * self.size))
+
+    # Worldmap listener
+    def update(self, changed, before, after):
+        self.refresh(np.unique(changed // 3))
+
+    # Recompute the frontier state of cells and their neighbors
+    def refresh(self, cells):
+        size = self.size
+        y, x = np.divmod(cells, size)
+        around = [cells]
+        for dy, dx in NEIGHBORS:
+            inside = (y + dy >= 0) & (y + dy < size) & (x + dx >= 0) & (x + dx < size)
+            around.append(cells[inside] + dy * size + dx)
+        cells = np.unique(np.concatenate(around))
+        y, x = np.divmod(cells, size)
+        next_to_unknown = np.zeros(len(cells), dtype=bool)
+        for dy, dx in NEIGHBORS:
+            inside = (y + dy >= 0) & (y + dy < size) & (x + dx >= 0) & (x + dx < size)
+            neighbors = cells[inside] + dy * size + dx
+            next_to_unknown[inside] |= ~self.worldmap.cell_counts(neighbors).any(axis=1)
+        self.frontier[cells] = (self.worldmap.cell_counts(cells)[:, 2] > 0) & next_to_unknown
+
+    # Pick the frontier cell to explore next from pos, None if there are none left
+    def select_goal(self, pos):
+        candidates = np.flatnonzero(self.frontier & ~self.given_up)
+        if len(candidates) == 0:
+            return None
+        y, x = np.divmod(candidates, self.size)
+        distances = np.hypot((x + 0.5) / self.resolution - pos[0], (y + 0.5) / self.resolution - pos[1])
+        far_enough = distances >= self.min_distance
+        if not np.any(far_enough):
+            return None
+        candidates = candidates[far_enough]
+        distances = distances[far_enough]
+        window = 2 * int(round(self.gain_radius * self.resolution)) + 1
+        gain = cv2.boxFilter(self.frontier.reshape(self.size, self.size).astype(np.float32), -1,
+                             (window, window), normalize=False).ravel()[candidates] / self.resolution
+        return candidates[np.argmin(distances - self.gain_weight * gain)]
+
+    # Never pick the cells of the square meter a cell is in again
+    def give_up(self, cell):
+        resolution = self.resolution
+        y, x = divmod(cell, self.size)
+        y -= y % resolution
+        x -= x % resolution
+        self.given_up.reshape(self.size, self.size)[y:y + resolution, x:x + resolution] = True
+
+    # Return the position to head for from pos to explore, None when there is nothing left to explore
+    def target(self, pos):
+        self.goal_frames += 1
+        if self.goal is not None:
+            reached = np.hypot(self.goal[0] - pos[0], self.goal[1] - pos[1]) < self.reach
+            if self.goal_frames > self.give_up_frames:
+                self.give_up(self.goal_cell)
+                self.goals_given_up += 1
+                self.goal = None
+            elif reached or not self.frontier[self.goal_cell]:
+                self.goal = None
+        if self.goal is None:
+            cell = self.select_goal(pos)
+            if cell is None:
+                return None
+            self.goal_cell = cell
+            self.goal = ((cell % self.size + 0.5) / self.resolution, (cell // self.size + 0.5) / self.resolution)
+            self.goal_frames = 0
+            self.goals += 1
+        return self.planner.next_waypoint(pos, self.goal)
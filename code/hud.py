@@ -0,0 +1,65 @@
+import threading
+import time
+
+from supporting_functions import HudSnapshot, render_output_images
+
+# Define a class that produces the inset images sent to the simulator with every command.
+# Drawing and JPEG encoding the insets is only done at the given rate (in Hz, 0 for every
+# frame) and the most recent images are sent in between, so the control loop does not wait
+# on visualization. With threaded set the images are drawn on a worker thread, and in
+# headless mode no images are drawn at all.
+class HudRenderer():
+    def __init__(self, rate=0, threaded=False, headless=False):
+        self.period = 1.0 / rate if rate > 0 else 0
+        self.threaded = threaded
+        self.headless = headless
+        self.last_render = None
+        # Most recent encoded images
+        self.images = ('', '')
+        self.frames_rendered = 0
+        self.pending = None
+        self.condition = threading.Condition()
+        self.worker = None
+        if threaded and not headless:
+            self.worker = threading.Thread(target=self.run, name='hud-renderer', daemon=True)
+            self.worker.start()
+
+    # Return the inset images to send for the current Rover state
+    def update(self, Rover):
+        if self.headless:
+            return '', ''
+        now = time.time()
+        if self.last_render is None or now - self.last_render >= self.period:
+            self.last_render = now
+            snapshot = HudSnapshot(Rover)
+            if self.threaded:
+                # Replace any snapshot the worker has not got to yet
+                with self.condition:
+                    self.pending = snapshot
+                    self.condition.notify()
+            else:
+                self.images = render_output_images(snapshot)
+                self.frames_rendered += 1
+        return self.images
+
+    # Worker thread loop, draws the latest snapshot
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                snapshot = self.pending
+                self.pending = None
+            if snapshot is False:
+                return
+            self.images = render_output_images(snapshot)
+            self.frames_rendered += 1
+
+    # Stop the worker thread
+    def stop(self):
+        if self.worker is not None:
+            with self.condition:
+                self.pending = False
+                self.condition.notify()
+            self.worker.join()
+            self.worker = None
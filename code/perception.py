@@ -1,5 +1,6 @@
 import numpy as np
 import cv2
+from collections import namedtuple
 
 from supporting_functions import distance_between
 
@@ -35,14 +36,75 @@ def color_range(img, rgb_thresh_bottom=(135, 100, -1), rgb_thresh_top=(200, 180,
     # Return the binary image
     return color_select
 
+# Label bits produced by the terrain classifier
+NAVIGABLE = 1
+ROCK = 2
+
+# Define a class that labels navigable terrain, rock samples and obstacles in a single pass.
+# Both color_thresh and color_range test every channel independently, so each channel can be
+# mapped through a 256 entry lookup table to the label bits it allows and the bits of the
+# three channels and-ed together. All outputs are written into buffers that are reused
+# between frames.
+class TerrainClassifier():
+    def __init__(self, rgb_thresh=(160, 160, 160),
+                 rock_thresh_bottom=(135, 100, -1), rock_thresh_top=(200, 180, 40)):
+        values = np.arange(256)
+        self.lut = np.zeros((1, 256, 3), dtype=np.uint8)
+        for channel in range(3):
+            navigable = values > rgb_thresh[channel]
+            rock = (values > rock_thresh_bottom[channel]) & (values < rock_thresh_top[channel])
+            self.lut[0, :, channel] = navigable * NAVIGABLE | rock * ROCK
+        self.shape = None
+
+    # Allocate the per-frame buffers for an image shape
+    def allocate(self, shape):
+        self.shape = tuple(shape[:2])
+        self.channel_labels = np.zeros(self.shape + (3,), dtype=np.uint8)
+        self.labels = np.zeros(self.shape, dtype=np.uint8)
+        self.navigable = np.zeros(self.shape, dtype=np.uint8)
+        self.rock = np.zeros(self.shape, dtype=np.uint8)
+        self.obstacle = np.zeros(self.shape, dtype=np.uint8)
+        self.rendered = np.zeros(self.shape + (3,), dtype=np.uint8)
+
+    # Classify an image, returning the navigable, rock and obstacle binary images.
+    # If a vision image is given the three classes are written into its channels.
+    def classify(self, img, vision_image=None):
+        if self.shape != img.shape[:2]:
+            self.allocate(img.shape)
+        cv2.LUT(img, self.lut, dst=self.channel_labels)
+        np.bitwise_and(self.channel_labels[:,:,0], self.channel_labels[:,:,1], out=self.labels)
+        np.bitwise_and(self.labels, self.channel_labels[:,:,2], out=self.labels)
+        np.bitwise_and(self.labels, NAVIGABLE, out=self.navigable)
+        np.right_shift(self.labels, 1, out=self.rock)
+        # Everything that is not navigable is considered an obstacle
+        np.bitwise_xor(self.navigable, 1, out=self.obstacle)
+        if vision_image is not None:
+            self.render(vision_image)
+        return self.navigable, self.rock, self.obstacle
+
+    # Write the last classification into the obstacle, rock and navigable channels of an image.
+    # A classification of a smaller image is scaled up to the size of the vision image.
+    def render(self, vision_image):
+        if vision_image.shape[:2] != self.shape:
+            self.render(self.rendered)
+            cv2.resize(self.rendered, (vision_image.shape[1], vision_image.shape[0]), dst=vision_image,
+                       interpolation=cv2.INTER_NEAREST)
+            return
+        np.multiply(self.obstacle, 255, out=vision_image[:,:,0])
+        np.multiply(self.rock, 255, out=vision_image[:,:,1])
+        np.multiply(self.navigable, 255, out=vision_image[:,:,2])
+
+# Classifier used by perception_step, its buffers are reused for every frame
+terrain_classifier = TerrainClassifier()
+
 # Define a function to convert to rover-centric coordinates
 def rover_coords(binary_img):
     # Identify nonzero pixels
     ypos, xpos = binary_img.nonzero()
     # Calculate pixel positions with reference to the rover position being at the
     # center bottom of the image.
-    x_pixel = -(ypos - binary_img.shape[0]).astype(np.float)
-    y_pixel = -(xpos - binary_img.shape[1]/2 ).astype(np.float)
+    x_pixel = -(ypos - binary_img.shape[0]).astype(float)
+    y_pixel = -(xpos - binary_img.shape[1]/2 ).astype(float)
     return x_pixel, y_pixel
 
 
@@ -56,6 +118,57 @@ def to_polar_coords(x_pixel, y_pixel):
     angles = np.arctan2(y_pixel, x_pixel)
     return dist, angles
 
+# Define a class holding the rover-centric coordinates, distance and angle of every pixel
+# of the warped image that is close enough to the rover to be used. The warped grid never
+# changes for an image shape, so these are computed once and perception only indexes into them.
+# Only the window of the image that bounds the max_distance range is kept.
+class RoverGrid():
+    def __init__(self, shape, max_distance=50, max_rock_distance=40, scale=1):
+        rows, cols = shape[:2]
+        self.shape = (rows, cols)
+        self.max_distance = max_distance
+        self.max_rock_distance = max_rock_distance
+        self.scale = scale
+        ypos, xpos = np.mgrid[0:rows, 0:cols]
+        # Same convention as rover_coords, the rover is at the center bottom of the image.
+        # The pixels of an image downsampled by scale are given in full resolution pixels.
+        x_pixel = -(ypos - rows).astype(np.float64) * scale
+        y_pixel = -(xpos - cols/2).astype(np.float64) * scale
+        dist, angles = to_polar_coords(x_pixel, y_pixel)
+        # Bounding box of the pixels within range
+        in_range = dist < max(max_distance, max_rock_distance)
+        range_rows, range_cols = in_range.nonzero()
+        self.window = (slice(range_rows.min(), range_rows.max() + 1),
+                       slice(range_cols.min(), range_cols.max() + 1))
+        # Per pixel tables, flattened over the window
+        self.x = x_pixel[self.window].ravel()
+        self.y = y_pixel[self.window].ravel()
+        self.dists = dist[self.window].ravel().astype(np.float32)
+        self.angles = angles[self.window].ravel().astype(np.float32)
+        # Static range masks over the window
+        self.in_range = dist[self.window] < max_distance
+        self.in_rock_range = dist[self.window] < max_rock_distance
+        # Buffer for the masked binary image
+        self.mask = np.zeros(self.in_range.shape, dtype=bool)
+
+    # Return the indices into the tables of the nonzero pixels of a binary image that are
+    # within range. in_range is either self.in_range or self.in_rock_range.
+    def select(self, binary_img, in_range):
+        np.logical_and(binary_img[self.window], in_range, out=self.mask)
+        return np.flatnonzero(self.mask)
+
+# Grids already computed, keyed by image shape and range
+_grid_cache = {}
+
+# Define a function to look up (or compute on first use) the rover grid for an image shape
+def get_rover_grid(shape, max_distance=50, max_rock_distance=40, scale=1):
+    key = (tuple(shape[:2]), max_distance, max_rock_distance, scale)
+    grid = _grid_cache.get(key)
+    if grid is None:
+        grid = RoverGrid(shape, max_distance, max_rock_distance, scale)
+        _grid_cache[key] = grid
+    return grid
+
 # Define a function to apply a rotation to pixel positions
 def rotate_pix(xpix, ypix, yaw):
     # Convert yaw to radians
@@ -87,41 +200,152 @@ def pix_to_world(xpix, ypix, xpos, ypos, yaw, world_size, scale):
     # Return the result
     return x_pix_world, y_pix_world
 
+# Define a function to apply rotation, translation and clipping to the pixels of several
+# terrain classes seen from the same pose. xpix and ypix hold the pixels of all classes
+# concatenated and lengths the number of pixels of each class. The rotation is computed
+# once and a list with the world x and y pixels of each class is returned, or the flat
+# indices (y * world_size + x) into the worldmap if flat is True.
+def pix_to_world_batch(xpix, ypix, lengths, xpos, ypos, yaw, world_size, scale, flat=False):
+    yaw_rad = yaw * np.pi / 180
+    cos_yaw = np.cos(yaw_rad)
+    sin_yaw = np.sin(yaw_rad)
+    # Same operations as rotate_pix and translate_pix, truncating to int only once
+    x_pix_world = (xpos + (xpix * cos_yaw - ypix * sin_yaw) / scale).astype(np.int_)
+    y_pix_world = (ypos + (xpix * sin_yaw + ypix * cos_yaw) / scale).astype(np.int_)
+    np.clip(x_pix_world, 0, world_size - 1, out=x_pix_world)
+    np.clip(y_pix_world, 0, world_size - 1, out=y_pix_world)
+    splits = np.cumsum(lengths)[:-1]
+    if flat:
+        return np.split(y_pix_world * world_size + x_pix_world, splits)
+    return list(zip(np.split(x_pix_world, splits), np.split(y_pix_world, splits)))
+
+# Fixed point bilinear interpolation of cv2.warpPerspective: steps per pixel of the sampled
+# coordinates, and bits of the weights
+TAP_STEPS = 32
+TAP_BITS = 15
+TAP_SCALE = 1 << TAP_BITS
+
+# Define a class to hold a perspective transform for a given image shape and
+# set of calibration points. The transform matrix (and optionally a remap table
+# to apply it with) only depends on those, so it is computed once and reused for every frame.
+class PerspectiveCalibration():
+    def __init__(self, shape, src, dst, use_remap=False, output_shape=None):
+        self.shape = tuple(shape[:2])
+        # Shape of the warped image, the input shape unless given
+        self.output_shape = self.shape if output_shape is None else tuple(output_shape[:2])
+        self.src = np.float32(src)
+        self.dst = np.float32(dst)
+        self.M = cv2.getPerspectiveTransform(self.src, self.dst)
+        self.map1 = None
+        self.map2 = None
+        if use_remap:
+            self.map1, self.map2 = self.build_remap()
+        # Output image reused between frames by perception_step
+        self.warped = np.zeros(self.output_shape + (3,), dtype=np.uint8)
+
+    # Return the input image coordinates sampled for output pixels (xs, ys)
+    def source_coords(self, xs, ys):
+        # Every output pixel samples the input image at M^-1 * (x, y, 1), summed in the order
+        # cv2.warpPerspective sums it, so pixels next to the horizon line round the same way
+        Minv = np.linalg.inv(self.M)
+        w = (Minv[2, 1] * ys + Minv[2, 2]) + Minv[2, 0] * xs
+        # Pixels on the horizon line (w == 0) sample the origin, like cv2.warpPerspective does
+        w[w == 0] = np.inf
+        return ((Minv[0, 1] * ys + Minv[0, 2]) + Minv[0, 0] * xs) / w, \
+               ((Minv[1, 1] * ys + Minv[1, 2]) + Minv[1, 0] * xs) / w
+
+    # Build the lookup table that cv2.remap needs to reproduce cv2.warpPerspective
+    def build_remap(self):
+        rows, cols = self.output_shape
+        xs, ys = np.meshgrid(np.arange(cols, dtype=np.float64), np.arange(rows, dtype=np.float64))
+        map_x, map_y = self.source_coords(xs, ys)
+        # Fixed point maps are considerably faster to sample than floating point ones
+        return cv2.convertMaps(map_x.astype(np.float32), map_y.astype(np.float32), cv2.CV_16SC2)
+
+    # Return the flat input pixel indices and weights of the four bilinear interpolation
+    # taps of every output pixel in a window, for sampling stacks of images at once.
+    # The weights are the fixed point ones of cv2.warpPerspective: coordinates are rounded to
+    # 1/TAP_STEPS of a pixel and the weights of a pixel add up to TAP_SCALE, so
+    # (sum of taps * weights + TAP_SCALE // 2) >> TAP_BITS gives the same pixel values.
+    # Taps outside the input image get a zero weight, like the zero border of cv2.warpPerspective.
+    def bilinear_taps(self, window):
+        rows, cols = self.shape
+        ys, xs = np.mgrid[window]
+        map_x, map_y = self.source_coords(xs.ravel().astype(np.float64), ys.ravel().astype(np.float64))
+        map_x = np.rint(np.clip(map_x, -2, cols + 1) * TAP_STEPS).astype(np.int_)
+        map_y = np.rint(np.clip(map_y, -2, rows + 1) * TAP_STEPS).astype(np.int_)
+        x0, fx = np.divmod(map_x, TAP_STEPS)
+        y0, fy = np.divmod(map_y, TAP_STEPS)
+        unit = TAP_SCALE // (TAP_STEPS * TAP_STEPS)
+        indices = []
+        weights = []
+        for dy, dx, weight in ((0, 0, (TAP_STEPS - fx) * (TAP_STEPS - fy)), (0, 1, fx * (TAP_STEPS - fy)),
+                               (1, 0, (TAP_STEPS - fx) * fy), (1, 1, fx * fy)):
+            x = x0 + dx
+            y = y0 + dy
+            inside = (x >= 0) & (x < cols) & (y >= 0) & (y < rows)
+            indices.append(np.where(inside, y * cols + x, 0))
+            weights.append(np.where(inside, weight * unit, 0).astype(np.int32))
+        return np.array(indices), np.array(weights)
+
+    # Apply the transform, optionally writing into a preallocated output image
+    def warp(self, img, out=None):
+        if self.map1 is not None:
+            return cv2.remap(img, self.map1, self.map2, cv2.INTER_LINEAR, dst=out)
+        return cv2.warpPerspective(img, self.M, (self.output_shape[1], self.output_shape[0]), dst=out)
+
+# Calibrations already computed, keyed by image shape and calibration points so
+# that a change of camera resolution or calibration produces a new transform
+_calibration_cache = {}
+
+# Define a function to look up (or compute on first use) the calibration for an image shape
+def get_calibration(shape, src, dst, use_remap=False, output_shape=None):
+    src = np.float32(src)
+    dst = np.float32(dst)
+    key = (tuple(shape[:2]), src.tobytes(), dst.tobytes(), use_remap,
+           None if output_shape is None else tuple(output_shape[:2]))
+    calibration = _calibration_cache.get(key)
+    if calibration is None:
+        calibration = PerspectiveCalibration(shape, src, dst, use_remap, output_shape)
+        _calibration_cache[key] = calibration
+    return calibration
+
+# Define a function to get the calibration of the rover camera for a given image shape.
+# The source points were picked on the calibration grid image and the destination
+# box warps the image to a grid where each 10x10 pixel square represents 1 square meter.
+# With downsample above 1 the image is warped straight to a grid that many times smaller
+# in each direction, e.g. 5x5 pixels per square meter with downsample 2.
+def camera_calibration(shape, dst_size=5, bottom_offset=10, use_remap=False, downsample=1):
+    source = np.float32([[14, 140], [301 ,140],[200, 96], [118, 96]])
+    destination = np.float32([[shape[1]/2 - dst_size, shape[0] - bottom_offset],
+                  [shape[1]/2 + dst_size, shape[0] - bottom_offset],
+                  [shape[1]/2 + dst_size, shape[0] - 2*dst_size - bottom_offset],
+                  [shape[1]/2 - dst_size, shape[0] - 2*dst_size - bottom_offset],
+                  ])
+    if downsample == 1:
+        return get_calibration(shape, source, destination, use_remap)
+    output_shape = (shape[0] // downsample, shape[1] // downsample)
+    return get_calibration(shape, source, destination / downsample, use_remap, output_shape)
+
 # Define a function to perform a perspective transform
 def perspect_transform(img, src, dst):
-           
-    M = cv2.getPerspectiveTransform(src, dst)
-    warped = cv2.warpPerspective(img, M, (img.shape[1], img.shape[0]))  # keep same size as input image
-    
+    # The transform for these calibration points is only computed the first time
+    warped = get_calibration(img.shape, src, dst).warp(img)  # keep same size as input image
+
     return warped
 
+# Define a function to record the world position of a detected rock sample, unless a sample
+# within 5 meters was recorded already. Returns whether the position was added.
 def add_sample_pos(Rover, rock_x_world, rock_y_world):
-    print(rock_x_world, rock_y_world)
-    sample_pos = np.array([[rock_x_world, rock_y_world]])
-    if Rover.samples_pos is None:
-        Rover.samples_pos = sample_pos
-        Rover.samples_found += Rover.samples_found
-        Rover.samples_to_find -= Rover.samples_to_find
-    else:
-        samples = Rover.samples_pos
-        add_sample = True
-        for i in range(len(Rover.samples_pos)):
-            sample = samples[i]
-            distance = distance_between(sample, (rock_x_world, rock_y_world))
-            if distance < 5:
-                # A rock sample exists for this location already.
-                add_sample = False
-                break
-
-        if add_sample:
-            print(samples, sample_pos)
-            Rover.samples_pos = np.concatenate((samples, sample_pos), axis=0)
-            Rover.samples_found += Rover.samples_found
-            Rover.samples_to_find -= Rover.samples_to_find
-
-
-# Apply the above functions in succession and update the Rover state accordingly
-def perception_step(Rover):
+    return Rover.detected_samples.insert_unique(rock_x_world, rock_y_world, 5) is not None
+
+
+# Apply the above functions in succession and update the Rover state accordingly.
+# With reduced set only the navigable and rock polar coordinates and the rock position
+# are updated, the vision image and worldmap are left as they are.
+# With downsample above 1 the camera image is warped to a bird's-eye grid that many times
+# smaller in each direction (see camera_calibration), trading some fidelity for speed.
+def perception_step(Rover, reduced=False, downsample=1):
     # Perform perception steps to update Rover()
     # NOTE: camera image is coming to you in Rover.img
     img = Rover.img
@@ -130,31 +354,20 @@ def perception_step(Rover):
     pitch_thresh_inv = 360.0 - pitch_thresh
 
     if (pitch_thresh <= Rover.pitch <= pitch_thresh_inv) or (pitch_thresh <= Rover.roll <= pitch_thresh_inv):
-        Rover.vision_image = np.zeros_like(img)
-        Rover.nav_angles = np.array([])
-        Rover.nav_dists = np.array([])
+        Rover.vision_image[:] = 0
+        Rover.nav_angles = Rover.nav_buffer[0, :0]
+        Rover.nav_dists = Rover.nav_buffer[1, :0]
         return Rover
 
-    # 1) Define source and destination points for perspective transform
-    bottom_offset = 10
-    # Define calibration box in source (actual) and destination (desired) coordinates
-    # These source and destination points are defined to warp the image
-    # to a grid where each 10x10 pixel square represents 1 square meter
+    # 1) Get the source and destination points for perspective transform
     # The destination box will be 2*dst_size on each side
     dst_size = 5
-    
-    source = np.float32([[14, 140], [301 ,140],[200, 96], [118, 96]])
-    destination = np.float32([[img.shape[1]/2 - dst_size, img.shape[0] - bottom_offset],
-                  [img.shape[1]/2 + dst_size, img.shape[0] - bottom_offset],
-                  [img.shape[1]/2 + dst_size, img.shape[0] - 2*dst_size - bottom_offset], 
-                  [img.shape[1]/2 - dst_size, img.shape[0] - 2*dst_size - bottom_offset],
-                  ])
+    # The calibration is computed once per image shape and reused for every frame
+    calibration = camera_calibration(img.shape, dst_size, downsample=downsample)
     # 2) Apply perspective transform
-    warped = perspect_transform(img, source, destination)
+    warped = calibration.warp(img, out=calibration.warped)
     # 3) Apply color threshold to identify navigable terrain/obstacles/rock samples
-    navigable_threshed = color_thresh(warped)
-    rock_threshed = color_range(warped)
-    obsticle_threshed = ~navigable_threshed
+    navigable_threshed, rock_threshed, obsticle_threshed = terrain_classifier.classify(warped)
 
     # Use only the left half of the image since we are hugging the left wall, we want to ignore rocks on the right.
     rock_threshed[:, int(rock_threshed.shape[1] * 0.5)] = 0
@@ -163,79 +376,150 @@ def perception_step(Rover):
         # Example: Rover.vision_image[:,:,0] = obstacle color-thresholded binary image
         #          Rover.vision_image[:,:,1] = rock_sample color-thresholded binary image
         #          Rover.vision_image[:,:,2] = navigable terrain color-thresholded binary image
-    Rover.vision_image[:,:,0] = obsticle_threshed * 255
-    Rover.vision_image[:,:,1] = rock_threshed * 255
-    Rover.vision_image[:,:,2] = navigable_threshed * 255
+    if not reduced:
+        terrain_classifier.render(Rover.vision_image)
     # 5) Convert map image pixel values to rover-centric coords
-    navigable_xpix, navigable_ypix = rover_coords(navigable_threshed)
-    rock_xpix, rock_ypix = rover_coords(rock_threshed)
-    obsticle_xpix, obsticle_ypix = rover_coords(obsticle_threshed)
-
+    # Only pixels within range are used, their coordinates come from the precomputed grid
     max_distance = 50
     max_rock_distance = 40
-    good_navigable = np.sqrt(navigable_xpix ** 2 + navigable_ypix ** 2) < max_distance
-    good_navigable_x = navigable_xpix[good_navigable]
-    good_navigable_y = navigable_ypix[good_navigable]
-    
-    good_rock = np.sqrt(rock_xpix**2 + rock_ypix**2) < max_rock_distance
-    good_rock_x = rock_xpix[good_rock]
-    good_rock_y = rock_ypix[good_rock]
-    
-    good_obsticle = np.sqrt(obsticle_xpix**2 + obsticle_ypix**2) < max_distance
-    good_obsticle_x = obsticle_xpix[good_obsticle]
-    good_obsticle_y = obsticle_ypix[good_obsticle]
+    grid = get_rover_grid(warped.shape, max_distance, max_rock_distance, downsample)
+    good_navigable = grid.select(navigable_threshed, grid.in_range)
+    good_rock = grid.select(rock_threshed, grid.in_rock_range)
+    # A reduced pass only needs the rock pixels in world coordinates
+    if reduced:
+        mapped_navigable = good_obsticle = good_rock[:0]
+    else:
+        mapped_navigable = good_navigable
+        good_obsticle = grid.select(obsticle_threshed, grid.in_range)
 
     # 6) Convert rover-centric pixel values to world coordinates
-    scale = 2 * dst_size
-    navigable_xpix_world, navigable_ypix_world = pix_to_world(good_navigable_x,
-                                                              good_navigable_y,
-                                                              Rover.pos[0],
-                                                              Rover.pos[1],
-                                                              Rover.yaw,
-                                                              Rover.worldmap.shape[0],
-                                                              scale)
-    rock_xpix_world, rock_ypix_world = pix_to_world(good_rock_x,
-                                                    good_rock_y,
-                                                    Rover.pos[0],
-                                                    Rover.pos[1],
-                                                    Rover.yaw,
-                                                    Rover.worldmap.shape[0],
-                                                    scale)
-    obsticle_xpix_world, obsticle_ypix_world = pix_to_world(good_obsticle_x,
-                                                            good_obsticle_y,
-                                                            Rover.pos[0],
-                                                            Rover.pos[1],
-                                                            Rover.yaw,
-                                                            Rover.worldmap.shape[0],
-                                                            scale)
+    # All classes share the rover pose so they are projected together, to worldmap cells
+    # of 1/resolution meters
+    resolution = Rover.worldmap.resolution
+    scale = 2 * dst_size / resolution
+    good_pixels = np.concatenate((mapped_navigable, good_rock, good_obsticle))
+    navigable_world, rock_world, obsticle_world = pix_to_world_batch(grid.x[good_pixels],
+                                                                     grid.y[good_pixels],
+                                                                     (len(mapped_navigable),
+                                                                      len(good_rock),
+                                                                      len(good_obsticle)),
+                                                                     Rover.pos[0] * resolution,
+                                                                     Rover.pos[1] * resolution,
+                                                                     Rover.yaw,
+                                                                     Rover.worldmap.size,
+                                                                     scale,
+                                                                     flat=True)
     # 7) Update Rover worldmap (to be displayed on right side of screen)
-        # Example: Rover.worldmap[obstacle_y_world, obstacle_x_world, 0] += 1
-        #          Rover.worldmap[rock_y_world, rock_x_world, 1] += 1
-        #          Rover.worldmap[navigable_y_world, navigable_x_world, 2] += 1
-    Rover.worldmap[navigable_ypix_world, navigable_xpix_world, 2] += 1
-    Rover.worldmap[rock_ypix_world, rock_xpix_world, 1] += 1
-    # Rover.worldmap[navigable_ypix_world, navigable_xpix_world, 0] -= 1
-    Rover.worldmap[obsticle_ypix_world, obsticle_xpix_world, 0] += 1
-    # 8) Convert rover-centric pixel positions to polar coordinates
-    distances, angles  = to_polar_coords(good_navigable_x, good_navigable_y)
+        # Channel 0: obstacles, channel 1: rock samples, channel 2: navigable terrain
+        # Every pixel counts as a detection, including several pixels falling in the same cell
+    if not reduced:
+        Rover.worldmap.update((obsticle_world, rock_world, navigable_world))
+    # 8) Look up the polar coordinates of the rover-centric pixel positions
     # Update Rover pixel distances and angles
         # Rover.nav_dists = rover_centric_pixel_distances
         # Rover.nav_angles = rover_centric_angles
-    Rover.nav_dists = distances
-    Rover.nav_angles = angles
+    # The lookups are written into the Rover's buffers instead of new arrays
+    if downsample > 1:
+        # A downsampled pixel stands for downsample**2 full resolution pixels, repeat it as many
+        # times so the pixel count thresholds of the decision step keep their meaning
+        good_navigable = np.repeat(good_navigable, downsample * downsample)
+        good_rock = np.repeat(good_rock, downsample * downsample)
+    Rover.nav_angles = np.take(grid.angles, good_navigable, out=Rover.nav_buffer[0, :len(good_navigable)])
+    Rover.nav_dists = np.take(grid.dists, good_navigable, out=Rover.nav_buffer[1, :len(good_navigable)])
     
-    # Generate rover-centric polar corrdinates for rock
-    rock_distances, rock_angles = to_polar_coords(good_rock_x, good_rock_y)
-    Rover.rock_dists = rock_distances
-    Rover.rock_angles = rock_angles
-
-    if len(rock_xpix_world) > 0:
-        rock_world_x = np.mean(rock_xpix_world[rock_xpix_world > 0])
-        rock_world_y = np.mean(rock_ypix_world[rock_ypix_world > 0])
+    # Rover-centric polar corrdinates for rock
+    Rover.rock_angles = np.take(grid.angles, good_rock, out=Rover.rock_buffer[0, :len(good_rock)])
+    Rover.rock_dists = np.take(grid.dists, good_rock, out=Rover.rock_buffer[1, :len(good_rock)])
+
+    rock_ypix_world, rock_xpix_world = np.divmod(rock_world, Rover.worldmap.size)
+    rock_xpix_world = rock_xpix_world[rock_xpix_world > 0]
+    rock_ypix_world = rock_ypix_world[rock_ypix_world > 0]
+    # Rock pixels all on the edge of the map give no position
+    if len(rock_xpix_world) > 0 and len(rock_ypix_world) > 0:
+        rock_world_x = np.mean(rock_xpix_world) / resolution
+        rock_world_y = np.mean(rock_ypix_world) / resolution
         if Rover.current_sample_pos is not None \
                 and distance_between((rock_world_x, rock_world_y), Rover.current_sample_pos) < 3:
             Rover.current_sample_pos = [np.mean([rock_world_x, Rover.current_sample_pos[0]]),
                                         np.mean([rock_world_y, Rover.current_sample_pos[1]])]
         else:
             Rover.current_sample_pos = [rock_world_x, rock_world_y]
-    return Rover
\ No newline at end of file
+        add_sample_pos(Rover, rock_world_x, rock_world_y)
+    return Rover
+
+# Results of perception_batch. nav_angles, nav_dists, rock_angles and rock_dists are
+# lists with an array per frame, worldmap_delta holds the (world_size, world_size, 3)
+# detection counts of all frames and valid tells which frames were used (frames with
+# too much pitch or roll are discarded, as in perception_step)
+BatchPerception = namedtuple('BatchPerception', ['nav_angles', 'nav_dists', 'rock_angles', 'rock_dists',
+                                                 'worldmap_delta', 'valid'])
+
+# Define a function to run perception on a stack of frames at once.
+# frames is an (N, rows, cols, 3) uint8 array and poses an (N, 3) array of x, y and yaw,
+# or (N, 5) with pitch and roll as well. Every step of perception_step is applied to all
+# frames with numpy broadcasting: only the warped pixels within range are sampled, with the
+# fixed point bilinear interpolation of cv2.warpPerspective, then classified, projected and
+# counted into one worldmap delta. Frames are processed chunk_size at a time to bound memory
+# use. The worldmap has world_size cells of 1/resolution meters on each side.
+def perception_batch(frames, poses, world_size=200, dst_size=5, max_distance=50,
+                     max_rock_distance=40, classifier=terrain_classifier, chunk_size=64, resolution=1):
+    frames = np.asarray(frames)
+    poses = np.asarray(poses, dtype=np.float64)
+    count, rows, cols = frames.shape[:3]
+    calibration = camera_calibration(frames.shape[1:], dst_size)
+    grid = get_rover_grid(frames.shape[1:], max_distance, max_rock_distance)
+    tap_indices, tap_weights = calibration.bilinear_taps(grid.window)
+    in_range = grid.in_range.ravel()
+    # Rock pixels of the center column are ignored, as in perception_step
+    window_cols = np.arange(grid.window[1].start, grid.window[1].stop)
+    in_rock_range = (grid.in_rock_range & (window_cols != int(cols * 0.5))).ravel()
+    lut = classifier.lut[0]
+    scale = 2 * dst_size / resolution
+
+    valid = np.ones(count, dtype=bool)
+    if poses.shape[1] >= 5:
+        pitch_thresh = 5.0
+        pitch_thresh_inv = 360.0 - pitch_thresh
+        valid = ~(((pitch_thresh <= poses[:, 3]) & (poses[:, 3] <= pitch_thresh_inv))
+                  | ((pitch_thresh <= poses[:, 4]) & (poses[:, 4] <= pitch_thresh_inv)))
+
+    nav_angles, nav_dists, rock_angles, rock_dists = [], [], [], []
+    hits = np.zeros(world_size * world_size * 3, dtype=np.int64)
+    for start in range(0, count, chunk_size):
+        chunk = frames[start:start + chunk_size].reshape(-1, rows * cols, 3)
+        chunk_poses = poses[start:start + chunk_size]
+        chunk_valid = valid[start:start + chunk_size]
+        # 2) Sample the warped pixels within range of every frame
+        warped = np.full(chunk.shape[:1] + tap_indices.shape[1:] + (3,), TAP_SCALE // 2, dtype=np.int32)
+        for indices, weights in zip(tap_indices, tap_weights):
+            warped += chunk[:, indices] * weights[:, None]
+        warped = (warped >> TAP_BITS).astype(np.uint8)
+        # 3) Classify with the lookup table of the classifier
+        labels = lut[warped[..., 0], 0] & lut[warped[..., 1], 1] & lut[warped[..., 2], 2]
+        navigable = ((labels & NAVIGABLE) > 0) & in_range
+        rock = ((labels & ROCK) > 0) & in_rock_range
+        obstacle = ((labels & NAVIGABLE) == 0) & in_range
+        navigable &= chunk_valid[:, None]
+        rock &= chunk_valid[:, None]
+        obstacle &= chunk_valid[:, None]
+        # 6) Project the grid of every frame to world coordinates
+        yaw_rad = chunk_poses[:, 2:3] * np.pi / 180
+        cos_yaw = np.cos(yaw_rad)
+        sin_yaw = np.sin(yaw_rad)
+        x_world = (chunk_poses[:, 0:1] * resolution + (grid.x * cos_yaw - grid.y * sin_yaw) / scale).astype(np.int_)
+        y_world = (chunk_poses[:, 1:2] * resolution + (grid.x * sin_yaw + grid.y * cos_yaw) / scale).astype(np.int_)
+        np.clip(x_world, 0, world_size - 1, out=x_world)
+        np.clip(y_world, 0, world_size - 1, out=y_world)
+        cells = (y_world * world_size + x_world) * 3
+        # 7) Count the detections of every channel
+        hits += np.bincount(np.concatenate((cells[obstacle], cells[rock] + 1, cells[navigable] + 2)),
+                            minlength=len(hits))
+        # 8) Look up the polar coordinates per frame
+        for frame_navigable, frame_rock in zip(navigable, rock):
+            nav_angles.append(grid.angles[frame_navigable])
+            nav_dists.append(grid.dists[frame_navigable])
+            rock_angles.append(grid.angles[frame_rock])
+            rock_dists.append(grid.dists[frame_rock])
+    worldmap_delta = np.minimum(hits, np.iinfo(np.uint32).max).astype(np.uint32)
+    return BatchPerception(nav_angles, nav_dists, rock_angles, rock_dists,
+                           worldmap_delta.reshape(world_size, world_size, 3), valid)
@@ -0,0 +1,153 @@
+import threading
+from collections import namedtuple
+
+from perception import perception_step
+from rover_state import RoverState
+from supporting_functions import TelemetryDecoder
+
+# Perception results of a frame, published by PerceptionPipeline
+PerceptionResult = namedtuple('PerceptionResult', ['frame', 'nav_angles', 'nav_dists', 'rock_angles',
+                                                   'rock_dists', 'current_sample_pos'])
+
+# Define a class standing in for the worldmap of the perception worker's Rover state: the
+# detections perception adds are queued instead, to be added to the real worldmap on the
+# event loop thread, so the worldmap and its listeners are only ever used from that thread
+class DeferredWorldMap():
+    def __init__(self, worldmap):
+        self.size = worldmap.size
+        self.resolution = worldmap.resolution
+        self.shape = worldmap.shape
+        self.pending = []
+
+    def update(self, cell_indices):
+        self.pending.append(cell_indices)
+
+    # Return the queued updates and start a new queue
+    def take(self):
+        pending = self.pending
+        self.pending = []
+        return pending
+
+
+# Define a class standing in for the detected samples index of the perception worker's Rover
+# state, queuing the sample positions to add for the event loop thread
+class DeferredSamples():
+    def __init__(self):
+        self.pending = []
+
+    def insert_unique(self, x, y, radius):
+        self.pending.append((x, y, radius))
+
+    # Return the queued positions and start a new queue
+    def take(self):
+        pending = self.pending
+        self.pending = []
+        return pending
+
+
+# Define a class running camera image decoding and perception on a worker thread, so the
+# telemetry handler only parses the telemetry values, runs the decision step on the freshest
+# perception results and sends the commands. Only the latest submitted frame is processed:
+# a frame submitted while the worker is busy replaces the one waiting, if any.
+# The worker perceives with a Rover state of its own that shares the vision image with the
+# Rover state of the telemetry handler, and publishes copies of the polar coordinates, so the
+# decision step never sees them change. Its worldmap updates and detected samples are queued
+# and applied to the Rover state of the telemetry handler by apply(), on the event loop thread
+# with everything else that reads them (decision step, planner, map statistics, HUD).
+class PerceptionPipeline():
+    def __init__(self, Rover, downsample=1, scheduler=None):
+        self.downsample = downsample
+        self.scheduler = scheduler
+        self.decoder = TelemetryDecoder()
+        self.shadow = RoverState(Rover.ground_truth, Rover.vision_image.shape[:2])
+        self.shadow.worldmap = DeferredWorldMap(Rover.worldmap)
+        self.shadow.vision_image = Rover.vision_image
+        self.shadow.detected_samples = DeferredSamples()
+        # Frame waiting for the worker, latest result and the frame it was applied up to
+        self.pending = None
+        self.result = None
+        self.applied = -1
+        # Worldmap updates and sample positions of the frames perceived since the last apply
+        self.map_updates = []
+        self.sample_updates = []
+        # Counters
+        self.submitted = 0
+        self.perceived = 0
+        self.dropped = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        self.worker = threading.Thread(target=self.run, name='perception-pipeline', daemon=True)
+        self.worker.start()
+
+    # Queue the camera image string of a telemetry packet, with the Rover state it was received in
+    def submit(self, image_string, Rover):
+        state = (Rover.vel, list(Rover.pos), Rover.yaw, Rover.pitch, Rover.roll, Rover.throttle,
+                 Rover.brake, Rover.steer, Rover.mode, Rover.current_sample_pos)
+        with self.condition:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = (self.submitted, image_string, state)
+            self.submitted += 1
+            self.condition.notify()
+
+    # Worker thread loop, decodes and perceives the latest frame
+    def run(self):
+        shadow = self.shadow
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                frame, image_string, state = self.pending
+                self.pending = None
+            (shadow.vel, shadow.pos, shadow.yaw, shadow.pitch, shadow.roll, shadow.throttle,
+             shadow.brake, shadow.steer, shadow.mode, shadow.current_sample_pos) = state
+            shadow.img = self.decoder.decode_image(image_string)
+            if self.scheduler is not None:
+                shadow = self.scheduler.step(shadow)
+            else:
+                shadow = perception_step(shadow, downsample=self.downsample)
+            result = PerceptionResult(frame, shadow.nav_angles.copy(), shadow.nav_dists.copy(),
+                                      shadow.rock_angles.copy() if shadow.rock_angles is not None else None,
+                                      shadow.rock_dists.copy() if shadow.rock_dists is not None else None,
+                                      shadow.current_sample_pos)
+            with self.condition:
+                self.map_updates.extend(shadow.worldmap.take())
+                self.sample_updates.extend(shadow.detected_samples.take())
+                self.result = result
+            self.perceived += 1
+
+    # Add the queued worldmap updates and sample positions to the Rover state and set its
+    # perception results to the latest ones published. Returns whether they are newer than
+    # the ones it had.
+    def apply(self, Rover):
+        with self.condition:
+            result = self.result
+            map_updates = self.map_updates
+            sample_updates = self.sample_updates
+            self.map_updates = []
+            self.sample_updates = []
+        for cell_indices in map_updates:
+            Rover.worldmap.update(cell_indices)
+        for x, y, radius in sample_updates:
+            Rover.detected_samples.insert_unique(x, y, radius)
+        if result is None or result.frame == self.applied:
+            return False
+        self.applied = result.frame
+        Rover.nav_angles = result.nav_angles
+        Rover.nav_dists = result.nav_dists
+        Rover.rock_angles = result.rock_angles
+        Rover.rock_dists = result.rock_dists
+        # Without rocks in view perception passes the sample position through, and the
+        # decision step may have cleared it since the frame was submitted
+        if result.rock_dists is not None and len(result.rock_dists) > 0:
+            Rover.current_sample_pos = result.current_sample_pos
+        return True
+
+    # Stop the worker thread
+    def stop(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.worker.join()
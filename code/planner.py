@@ -0,0 +1,247 @@
+import heapq
+import time
+
+import cv2
+import numpy as np
+
+# Define a class planning paths over the worldmap with A*.
+# A cell is blocked when it has obstacle detections but was never seen navigable, and unknown
+# without detections. Cells seen navigable cost 1 / (their share of navigable detections) to
+# cross, up to max_cost, where obstacle detections are scaled by the ratio of the mean counts
+# of the two channels as on the HUD map. The rover's own footprint and the edges of the camera
+# view leave obstacle detections on good terrain, so those cells are made expensive rather
+# than blocked. Unknown cells cost unknown_cost and cells next to blocked ones at least
+# wall_cost, so paths keep away from walls and prefer mapped terrain. The path is turned into
+# waypoints waypoint_spacing cells apart for the controller to follow.
+# Replanning is incremental: as a WorldMap listener the planner only looks at the cells
+# that changed, and a new path is only planned when the goal moves, a cell of the current
+# path becomes blocked, the rover strays deviation cells from the path, or replan_interval
+# frames have passed (to take newly mapped shortcuts).
+# Planning runs in the control loop, so the search is spread over frames: each call of
+# next_waypoint searches for at most frame_budget seconds, and the rover keeps following the
+# previous path (or heads straight for a new goal) until the search is over.
+# Positions are in meters and paths are planned over 1 meter cells whatever the resolution of
+# the worldmap, each with the sum of the counts of the worldmap cells it covers, so a finer
+# map plans the same paths in the same time.
+class GridPlanner():
+    def __init__(self, worldmap, unknown_cost=4.0, wall_cost=3.0, max_cost=20.0, replan_interval=100,
+                 max_expansions=20000, waypoint_spacing=4, reach=1.5, deviation=4.0, frame_budget=0.003):
+        self.worldmap = worldmap
+        self.resolution = worldmap.resolution
+        self.size = -(-worldmap.size // self.resolution)
+        self.unknown_cost = unknown_cost
+        self.wall_cost = wall_cost
+        self.max_cost = max_cost
+        self.replan_interval = replan_interval
+        self.max_expansions = max_expansions
+        self.waypoint_spacing = waypoint_spacing
+        self.reach = reach
+        self.deviation = deviation
+        self.frame_budget = frame_budget
+        # Search in progress, if any
+        self.search = None
+        # Cells of the current path, flat cell indices (y * size + x)
+        self.path_mask = np.zeros(self.size * self.size, dtype=bool)
+        self.goal = None
+        self.waypoints = []
+        self.invalid = True
+        self.frames_since_plan = 0
+        # Counters
+        self.plans = 0
+        self.failed_plans = 0
+        worldmap.add_listener(self.update)
+
+    # Worldmap listener, invalidates the path if one of its cells became blocked
+    def update(self, changed, before, after):
+        if self.invalid or not self.path_mask.any():
+            return
+        channels = changed % 3
+        y, x = np.divmod(changed[channels != 1] // 3, self.worldmap.size)
+        cells = (y // self.resolution) * self.size + x // self.resolution
+        cells = np.unique(cells[self.path_mask[cells]])
+        if len(cells) > 0:
+            counts = self.cell_counts(cells)
+            if np.any((counts[:, 2] == 0) & (counts[:, 0] > 0)):
+                self.invalid = True
+
+    # Return the counts of 1 meter cells, summed over the worldmap cells they cover, as an
+    # (n, 3) array
+    def cell_counts(self, cells):
+        resolution = self.resolution
+        if resolution == 1:
+            return self.worldmap.cell_counts(cells)
+        y, x = np.divmod(cells, self.size)
+        offset_y, offset_x = np.divmod(np.arange(resolution * resolution), resolution)
+        y = y[:, None] * resolution + offset_y
+        x = x[:, None] * resolution + offset_x
+        inside = (y < self.worldmap.size) & (x < self.worldmap.size)
+        counts = np.zeros(y.shape + (3,), dtype=np.int64)
+        counts[inside] = self.worldmap.cell_counts(y[inside] * self.worldmap.size + x[inside])
+        return counts.sum(axis=1)
+
+    # Return the cost of crossing each cell, infinite for blocked cells
+    def costs(self):
+        counts = self.worldmap.view(self.resolution, total=True)
+        obstacle = counts[:,:,0].astype(np.float64)
+        navigable = counts[:,:,2].astype(np.float64)
+        obstacle_cells = self.worldmap.count_nonzero(0)
+        navigable_cells = self.worldmap.count_nonzero(2)
+        if obstacle_cells > 0 and navigable_cells > 0:
+            # Weigh obstacle detections by the ratio of the mean navigable and obstacle counts
+            obstacle *= (np.sum(navigable) / navigable_cells) / (np.sum(obstacle) / obstacle_cells)
+        seen = navigable > 0
+        blocked = ~seen & (obstacle > 0)
+        cost = np.full(blocked.shape, self.unknown_cost)
+        cost[seen] = np.minimum((navigable[seen] + obstacle[seen]) / navigable[seen], self.max_cost)
+        near_wall = cv2.dilate(blocked.astype(np.uint8), np.ones((3, 3), dtype=np.uint8)) > 0
+        cost[near_wall] = np.maximum(cost[near_wall], self.wall_cost)
+        cost[blocked] = np.inf
+        return cost.ravel()
+
+    # Plan a path from start to goal, world positions (x, y), all at once. Returns whether
+    # one was found.
+    def plan(self, start, goal):
+        self.start_search(start, goal)
+        self.search.run(self.max_expansions, np.inf)
+        return self.finish_search()
+
+    # Start searching for a path from start to goal, continued by next_waypoint
+    def start_search(self, start, goal):
+        cost = self.costs()
+        start_cell = self.cell(start)
+        goal_cell = self.cell(goal)
+        # The rover and its target are where they are, whatever the map says
+        cost[start_cell] = 1.0
+        cost[goal_cell] = min(cost[goal_cell], self.unknown_cost)
+        self.search = PathSearch(cost, self.size, start_cell, goal_cell)
+        self.plans += 1
+        self.goal = (goal[0], goal[1])
+        self.frames_since_plan = 0
+
+    # Set the path found by the search that is over. Returns whether one was found.
+    def finish_search(self):
+        search = self.search
+        self.search = None
+        self.invalid = False
+        self.path_mask[:] = False
+        if not search.found:
+            self.failed_plans += 1
+            self.waypoints = []
+            return False
+        path = search.path()
+        self.path_mask[path] = True
+        # Waypoints at cell centers, the last one the goal itself
+        cells = path[self.waypoint_spacing::self.waypoint_spacing]
+        self.waypoints = [self.center(cell) for cell in cells]
+        self.waypoints.append(self.goal)
+        return True
+
+    def cell(self, position):
+        x = min(max(int(position[0]), 0), self.size - 1)
+        y = min(max(int(position[1]), 0), self.size - 1)
+        return y * self.size + x
+
+    # Position of the center of a cell
+    def center(self, cell):
+        return (cell % self.size + 0.5, cell // self.size + 0.5)
+
+    # Return the position to head for from pos on the way to goal, replanning if needed.
+    # Without a path to the goal this is the goal itself.
+    def next_waypoint(self, pos, goal):
+        self.frames_since_plan += 1
+        moved = self.goal is None or np.hypot(goal[0] - self.goal[0], goal[1] - self.goal[1]) > 1
+        if moved:
+            # The current path and search lead elsewhere, head straight for the goal until
+            # there is a path to it
+            self.search = None
+            self.waypoints = []
+            self.path_mask[:] = False
+        if self.search is None:
+            replan = moved or self.invalid or self.frames_since_plan >= self.replan_interval
+            if not replan and len(self.waypoints) > 0:
+                distances = np.hypot(np.array(self.waypoints)[:, 0] - pos[0], np.array(self.waypoints)[:, 1] - pos[1])
+                replan = np.min(distances) > self.deviation + self.waypoint_spacing
+            if replan:
+                self.start_search(pos, goal)
+        if self.search is not None and self.search.run(self.max_expansions,
+                                                       time.perf_counter() + self.frame_budget):
+            self.finish_search()
+        # Skip the waypoints already reached
+        while len(self.waypoints) > 1 and np.hypot(self.waypoints[0][0] - pos[0],
+                                                   self.waypoints[0][1] - pos[1]) < self.reach:
+            self.waypoints.pop(0)
+        if len(self.waypoints) == 0:
+            return goal
+        return self.waypoints[0]
+
+
+# Define a class holding the state of an A* search over a grid of cell costs, so it can be
+# run a few expansions at a time. The costs and search state are plain Python lists and dicts,
+# much faster than numpy arrays for one cell at a time.
+class PathSearch():
+    def __init__(self, cost, size, start_cell, goal_cell):
+        self.cost = cost.tolist()
+        self.size = size
+        self.start_cell = start_cell
+        self.goal_cell = goal_cell
+        self.goal_y, self.goal_x = divmod(goal_cell, size)
+        self.g = {start_cell: 0.0}
+        self.came_from = {}
+        self.heap = [(0.0, start_cell)]
+        self.expansions = 0
+        self.found = False
+
+    # Expand cells until the goal is reached, there is nothing left to expand or max_expansions
+    # cells were expanded in all, or until the deadline (a time.perf_counter() time) passes.
+    # Returns whether the search is over.
+    def run(self, max_expansions, deadline):
+        size = self.size
+        cost = self.cost
+        g = self.g
+        came_from = self.came_from
+        heap = self.heap
+        goal_x = self.goal_x
+        goal_y = self.goal_y
+        while heap and self.expansions < max_expansions:
+            _, current = heapq.heappop(heap)
+            if current == self.goal_cell:
+                self.found = True
+                return True
+            self.expansions += 1
+            y, x = divmod(current, size)
+            current_g = g[current]
+            for dy, dx, step in NEIGHBORS:
+                ny = y + dy
+                nx = x + dx
+                if ny < 0 or ny >= size or nx < 0 or nx >= size:
+                    continue
+                neighbor = ny * size + nx
+                new_g = current_g + step * cost[neighbor]
+                if new_g < g.get(neighbor, INFINITY):
+                    g[neighbor] = new_g
+                    came_from[neighbor] = current
+                    # Octile distance, admissible as no cell costs less than 1
+                    ddx = abs(nx - goal_x)
+                    ddy = abs(ny - goal_y)
+                    heuristic = max(ddx, ddy) + DIAGONAL_EXTRA * min(ddx, ddy)
+                    heapq.heappush(heap, (new_g + heuristic, neighbor))
+            # At least one cell is expanded per call, so the search always gets somewhere
+            if self.expansions % 64 == 0 and time.perf_counter() > deadline:
+                return False
+        return True
+
+    # Cells of the path found, from the start to the goal
+    def path(self):
+        path = [self.goal_cell]
+        while path[-1] != self.start_cell:
+            path.append(self.came_from[path[-1]])
+        path.reverse()
+        return path
+
+
+INFINITY = float('inf')
+DIAGONAL_EXTRA = float(np.sqrt(2) - 1)
+# Moves to the 8 neighbors of a cell: (dy, dx, length)
+SQRT2 = float(np.sqrt(2))
+NEIGHBORS = [(-1, -1, SQRT2), (-1, 0, 1.0), (-1, 1, SQRT2), (0, -1, 1.0),
+             (0, 1, 1.0), (1, -1, SQRT2), (1, 0, 1.0), (1, 1, SQRT2)]
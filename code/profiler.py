@@ -0,0 +1,95 @@
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger('rover')
+
+# Define a class to time the stages of every frame and keep their latency distribution.
+# The last window durations of each stage are kept in a ring buffer, so the percentiles
+# reported describe recent frames rather than the whole run. Frames that take longer
+# than the budget (in seconds) are counted against the stage that took the longest.
+# Timing a stage costs two time.perf_counter calls, e.g.:
+#   with profiler.stage('perception'):
+#       Rover = perception_step(Rover)
+class StageProfiler():
+    def __init__(self, window=1000, budget=0.05):
+        self.window = window
+        self.budget = budget
+        # Stage name -> ring buffer of durations, number of samples recorded
+        self.durations = {}
+        self.counts = {}
+        # Durations of the stages of the current frame
+        self.frame = {}
+        self.frames = 0
+        self.frames_over_budget = 0
+        # Stage name -> number of frames over budget it was the slowest stage of
+        self.over_budget = {}
+
+    # Return a context manager timing a stage of the current frame
+    def stage(self, name):
+        return StageTimer(self, name)
+
+    # Add the duration of a stage
+    def record(self, name, duration):
+        if name not in self.durations:
+            self.durations[name] = np.zeros(self.window)
+            self.counts[name] = 0
+        self.durations[name][self.counts[name] % self.window] = duration
+        self.counts[name] += 1
+        self.frame[name] = self.frame.get(name, 0) + duration
+
+    # Close the current frame, recording its total time as the 'frame' stage
+    def end_frame(self):
+        if len(self.frame) == 0:
+            return
+        stages = self.frame
+        total = sum(stages.values())
+        self.frames += 1
+        if self.budget > 0 and total > self.budget:
+            self.frames_over_budget += 1
+            slowest = max(stages, key=stages.get)
+            self.over_budget[slowest] = self.over_budget.get(slowest, 0) + 1
+        self.record('frame', total)
+        self.frame = {}
+
+    # Return the 50th, 95th and 99th percentile and maximum duration of a stage over the window
+    def percentiles(self, name):
+        durations = self.durations[name][:min(self.counts[name], self.window)]
+        return tuple(np.percentile(durations, [50, 95, 99])) + (np.max(durations),)
+
+    # Return the latency report as a list of lines, durations in milliseconds
+    def report(self):
+        lines = ['{:<12} {:>8} {:>9} {:>9} {:>9} {:>9} {:>12}'.format(
+            'stage', 'samples', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'over budget')]
+        for name in self.durations:
+            p50, p95, p99, peak = self.percentiles(name)
+            over_budget = self.frames_over_budget if name == 'frame' else self.over_budget.get(name, 0)
+            lines.append('{:<12} {:>8} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>12}'.format(
+                name, self.counts[name], p50 * 1e3, p95 * 1e3, p99 * 1e3, peak * 1e3, over_budget))
+        if self.budget > 0:
+            lines.append('{} of {} frames over the {:.0f} ms budget'.format(
+                self.frames_over_budget, self.frames, self.budget * 1e3))
+        return lines
+
+    # Write the latency report to the log
+    def dump(self):
+        if len(self.durations) == 0:
+            return
+        for line in self.report():
+            logger.info(line)
+
+
+# Define a context manager adding the time spent in its block to a stage of a StageProfiler
+class StageTimer():
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, time.perf_counter() - self.started)
+        return False
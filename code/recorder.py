@@ -0,0 +1,93 @@
+import base64
+import collections
+import os
+import threading
+from datetime import datetime
+
+import cv2
+
+# Columns of the telemetry log, the same as the simulator's training mode robot_log.csv
+log_columns = ['Path', 'SteerAngle', 'Throttle', 'Brake', 'Speed',
+               'X_Position', 'Y_Position', 'Pitch', 'Yaw', 'Roll']
+
+# Define a class to record camera frames and telemetry of a run in the background.
+# Frames are written to <folder>/IMG and the telemetry to <folder>/robot_log.csv, the same
+# layout as a recording made in training mode. Frames are queued and written in batches by a
+# worker thread; when the queue is full the oldest frame is dropped so recording never
+# slows down the control loop. Frames can also be queued as the base64 JPEG string the
+# simulator sent, written out as is without decoding or encoding the image.
+class FrameRecorder():
+    def __init__(self, folder, max_queue=64, batch_size=16):
+        self.folder = folder
+        self.image_folder = os.path.join(folder, 'IMG')
+        if not os.path.exists(self.image_folder):
+            os.makedirs(self.image_folder)
+        self.log_path = os.path.join(folder, 'robot_log.csv')
+        with open(self.log_path, 'w') as log_file:
+            log_file.write(';'.join(log_columns) + '\n')
+        self.batch_size = batch_size
+        self.queue = collections.deque(maxlen=max_queue)
+        self.condition = threading.Condition()
+        self.closed = False
+        # Counters
+        self.queued = 0
+        self.recorded = 0
+        self.dropped = 0
+        self.worker = threading.Thread(target=self.run, name='frame-recorder', daemon=True)
+        self.worker.start()
+
+    # Queue the current camera frame and telemetry of the Rover
+    def record(self, image, Rover):
+        # The image buffer may be reused for the next frame, so keep a copy
+        self.enqueue(image.copy(), Rover)
+
+    # Queue the camera frame of a telemetry packet, its base64 JPEG string, and the telemetry
+    # of the Rover
+    def record_encoded(self, image_string, Rover):
+        self.enqueue(image_string, Rover)
+
+    def enqueue(self, image, Rover):
+        timestamp = datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f')[:-3]
+        row = [Rover.steer, Rover.throttle, Rover.brake, Rover.vel,
+               Rover.pos[0], Rover.pos[1], Rover.pitch, Rover.yaw, Rover.roll]
+        with self.condition:
+            # Frames received within the same millisecond still get files of their own
+            item = ('robocam_{}_{}.jpg'.format(timestamp, self.queued), image, row)
+            self.queued += 1
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(item)
+            self.condition.notify()
+
+    # Worker thread loop
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if not self.queue and self.closed:
+                    return
+                batch = [self.queue.popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+            self.write(batch)
+
+    # Write a batch of frames and append their telemetry to the log
+    def write(self, batch):
+        lines = []
+        for filename, image, row in batch:
+            path = os.path.join(self.image_folder, filename)
+            if isinstance(image, (str, bytes)):
+                with open(path, 'wb') as image_file:
+                    image_file.write(base64.b64decode(image))
+            else:
+                cv2.imwrite(path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+            lines.append(';'.join([path] + [str(value) for value in row]) + '\n')
+        with open(self.log_path, 'a') as log_file:
+            log_file.writelines(lines)
+        self.recorded += len(batch)
+
+    # Write out the frames still queued and stop the worker thread
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.worker.join()
@@ -0,0 +1,204 @@
+import argparse
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from perception import perception_step, perception_batch
+from decision import decision_step
+from supporting_functions import create_output_images
+from rover_state import RoverState
+from scheduler import PerceptionScheduler
+from frame_store import DatasetRun, open_run
+
+# Recorded run replayed by default
+default_dataset = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'generated_dataset')
+
+# Define a function to update the Rover state with a logged frame, as update_rover does
+# with telemetry from the simulator
+def set_telemetry(Rover, frame, img, frame_time):
+    Rover.vel = frame['vel']
+    Rover.pos = frame['pos']
+    Rover.yaw = frame['yaw']
+    Rover.pitch = frame['pitch']
+    Rover.roll = frame['roll']
+    Rover.throttle = frame['throttle']
+    Rover.steer = frame['steer']
+    Rover.img = img
+    Rover.total_time = frame_time
+    return Rover
+
+# Define a function to create a Rover state for replaying a run
+def replay_rover(map_resolution=1):
+    Rover = RoverState(map_resolution=map_resolution)
+    Rover.start_time = 0
+    # Sample positions are not logged, there are none to confirm detections against
+    Rover.samples_pos = (np.int_([]), np.int_([]))
+    return Rover
+
+# Define a function to replay frames start to stop of a recorded run through the perception
+# and decision steps as fast as possible. Returns the final Rover state and the time spent
+# in each stage. With a PerceptionScheduler given it decides the perception pass of each frame,
+# otherwise the full perception step runs on a grid downsampled by the given factor.
+# The worldmap has cells of 1/map_resolution meters.
+def replay(run, start=0, stop=None, decide=True, render=False, frame_period=0.05, scheduler=None,
+           downsample=1, map_resolution=1):
+    if stop is None:
+        stop = len(run)
+    Rover = replay_rover(map_resolution)
+    stages = ['load', 'perception', 'decision', 'render']
+    timings = {stage: np.zeros(stop - start) for stage in stages}
+    for idx in range(start, stop):
+        started = time.perf_counter()
+        set_telemetry(Rover, run.telemetry(idx), run.image(idx), idx * frame_period)
+        loaded = time.perf_counter()
+        if scheduler is not None:
+            Rover = scheduler.step(Rover)
+        else:
+            Rover = perception_step(Rover, downsample=downsample)
+        perceived = time.perf_counter()
+        if decide:
+            Rover = decision_step(Rover)
+        decided = time.perf_counter()
+        if render:
+            create_output_images(Rover)
+        rendered = time.perf_counter()
+        timings['load'][idx - start] = loaded - started
+        timings['perception'][idx - start] = perceived - loaded
+        timings['decision'][idx - start] = decided - perceived
+        timings['render'][idx - start] = rendered - decided
+    return Rover, timings
+
+# Define a function to map frames start to stop of a recorded run, opened from its folder
+# (with use_store False the JPEG frames are read even if the run was packed).
+# Only the perception step is run, it depends on nothing but the logged pose and camera
+# frame. Returns the worldmap counts and the rock detections as (frame index, x, y) tuples.
+def map_shard(shard):
+    folder, use_store, start, stop, map_resolution = shard
+    run = open_run(folder) if use_store else DatasetRun(folder)
+    Rover = replay_rover(map_resolution)
+    rocks = []
+    for idx in range(start, stop):
+        set_telemetry(Rover, run.telemetry(idx), run.image(idx), 0)
+        Rover = perception_step(Rover)
+        if Rover.rock_dists is not None and len(Rover.rock_dists) > 0 and Rover.current_sample_pos is not None:
+            rocks.append((idx, Rover.current_sample_pos[0], Rover.current_sample_pos[1]))
+    return np.asarray(Rover.worldmap), rocks
+
+# Define a function to map the first frames of a recorded run on a pool of worker processes.
+# The frames are split into one contiguous shard per worker and the partial worldmaps
+# are merged into the worldmap of a single Rover state, in shard order, so the result
+# does not depend on which worker finishes first.
+def parallel_map(folder, frames, workers, use_store=True, map_resolution=1):
+    shard_size = int(np.ceil(frames / workers))
+    shards = [(folder, use_store, start, min(start + shard_size, frames), map_resolution)
+              for start in range(0, frames, shard_size)]
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.map(map_shard, shards)
+    Rover = replay_rover(map_resolution)
+    rocks = []
+    for counts, shard_rocks in results:
+        Rover.worldmap.merge(counts)
+        rocks.extend(shard_rocks)
+    return Rover, sorted(rocks)
+
+# Define a function to map the first frames of a recorded run with perception_batch,
+# batch_size frames at a time
+def batch_map(run, frames, batch_size, map_resolution=1):
+    Rover = replay_rover(map_resolution)
+    for start in range(0, frames, batch_size):
+        stop = min(start + batch_size, frames)
+        result = perception_batch(run.images(start, stop), run.poses(start, stop),
+                                  world_size=Rover.worldmap.size, resolution=Rover.worldmap.resolution)
+        Rover.worldmap.merge(result.worldmap_delta)
+    return Rover
+
+# Define a function to compare mapping the first frames of a run at different downsampling
+# factors. Returns a (factor, perception time per frame, % mapped, % fidelity) tuple per factor.
+def compare_downsampling(run, frames, factors=(1, 2, 4), map_resolution=1):
+    report = []
+    for factor in factors:
+        Rover, timings = replay(run, 0, frames, decide=False, downsample=factor, map_resolution=map_resolution)
+        report.append((factor, np.mean(timings['perception']),
+                       Rover.map_stats.perc_mapped(), Rover.map_stats.fidelity()))
+    return report
+
+# Define a function to print the per stage timings and frame rates of a replay
+def print_report(Rover, timings):
+    frames = len(timings['load'])
+    print('Replayed {} frames'.format(frames))
+    total = np.zeros(frames)
+    for stage, durations in timings.items():
+        total += durations
+        print('{:<12} mean {:8.3f} ms   median {:8.3f} ms   max {:8.3f} ms   total {:8.2f} s'.format(
+            stage, np.mean(durations) * 1e3, np.median(durations) * 1e3,
+            np.max(durations) * 1e3, np.sum(durations)))
+    print('Frames per second: {:.1f} ({:.1f} excluding image loading)'.format(
+        frames / np.sum(total), frames / np.sum(total - timings['load'])))
+    print('Mapped: {}%  Fidelity: {}%'.format(Rover.map_stats.perc_mapped(), Rover.map_stats.fidelity()))
+    print('Rock samples seen: {}'.format(len(Rover.detected_samples)))
+    print('Worldmap: {} tiles allocated, {:.0f} KB'.format(Rover.worldmap.allocated, Rover.worldmap.nbytes / 1024))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded run')
+    parser.add_argument('dataset', type=str, nargs='?', default=default_dataset,
+                        help='Folder with the robot_log.csv and IMG folder of a recorded run.')
+    parser.add_argument('--limit', type=int, default=0, help='Only replay this many frames.')
+    parser.add_argument('--no-decision', action='store_true', help='Skip the decision step.')
+    parser.add_argument('--render', action='store_true', help='Also create the output images.')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Only map the run, using this many worker processes.')
+    parser.add_argument('--jpeg', action='store_true',
+                        help='Read the JPEG frames even if the run was packed with frame_store.py.')
+    parser.add_argument('--batch', type=int, default=0,
+                        help='Only map the run, with the batch perception API on this many frames at a time.')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Decide the perception pass of each frame with a PerceptionScheduler.')
+    parser.add_argument('--perception-budget', type=float, default=0,
+                        help='With --adaptive, run reduced passes while perception takes longer than this (ms).')
+    parser.add_argument('--downsample', type=int, default=1,
+                        help="Warp the camera image to a bird's-eye grid this many times smaller in each direction.")
+    parser.add_argument('--compare-downsampling', type=str, default=None,
+                        help='Compare mapping time and fidelity at these comma separated downsampling factors, e.g. 1,2,4.')
+    parser.add_argument('--map-resolution', type=int, default=1,
+                        help='Worldmap cells per meter, e.g. 4 for 0.25 m cells.')
+    args = parser.parse_args()
+
+    run = DatasetRun(args.dataset) if args.jpeg else open_run(args.dataset)
+    frames = len(run)
+    if args.limit > 0:
+        frames = min(frames, args.limit)
+    if args.compare_downsampling:
+        factors = [int(factor) for factor in args.compare_downsampling.split(',')]
+        print('Mapping {} frames'.format(frames))
+        report = compare_downsampling(run, frames, factors, args.map_resolution)
+        for factor, perception_time, perc_mapped, fidelity in report:
+            print('downsample {:<3} perception {:7.3f} ms/frame   mapped {:5.1f}%   fidelity {:5.1f}%'.format(
+                factor, perception_time * 1e3, perc_mapped, fidelity))
+    elif args.workers > 0:
+        start = time.perf_counter()
+        Rover, rocks = parallel_map(args.dataset, frames, args.workers, not args.jpeg, args.map_resolution)
+        elapsed = time.perf_counter() - start
+        print('Mapped {} frames with {} workers in {:.2f} s ({:.1f} frames per second)'.format(
+            frames, args.workers, elapsed, frames / elapsed))
+        print('Frames with rock detections: {}'.format(len(rocks)))
+        print('Mapped: {}%  Fidelity: {}%'.format(Rover.map_stats.perc_mapped(), Rover.map_stats.fidelity()))
+    elif args.batch > 0:
+        start = time.perf_counter()
+        Rover = batch_map(run, frames, args.batch, args.map_resolution)
+        elapsed = time.perf_counter() - start
+        print('Mapped {} frames in batches of {} in {:.2f} s ({:.1f} frames per second)'.format(
+            frames, args.batch, elapsed, frames / elapsed))
+        print('Mapped: {}%  Fidelity: {}%'.format(Rover.map_stats.perc_mapped(), Rover.map_stats.fidelity()))
+    else:
+        scheduler = None
+        if args.adaptive:
+            scheduler = PerceptionScheduler(budget=args.perception_budget / 1000.0, downsample=args.downsample)
+        Rover, timings = replay(run, 0, frames, decide=not args.no_decision, render=args.render,
+                                scheduler=scheduler, downsample=args.downsample, map_resolution=args.map_resolution)
+        print_report(Rover, timings)
+        if scheduler is not None:
+            print('Perception passes: {}'.format(', '.join(
+                '{} {}'.format(count, kind) for kind, count in scheduler.counts.items())))
@@ -0,0 +1,145 @@
+import os
+
+import matplotlib.image as mpimg
+import numpy as np
+
+from worldmap import WorldMap, MapStatistics
+from spatial_index import SampleIndex
+from planner import GridPlanner
+from frontier import FrontierExplorer
+
+# Ground truth map of the simulator environment
+ground_truth_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calibration_images', 'map_bw.png')
+
+# Read in ground truth map and create 3-channel green version for overplotting
+# NOTE: images are read in by default with the origin (0, 0) in the upper left
+# and y-axis increasing downward.
+ground_truth = mpimg.imread(ground_truth_path)
+# This next line creates arrays of zeros in the red and blue channels
+# and puts the map into the green channel.  This is why the underlying 
+# map output looks green in the display image
+ground_truth_3d = np.dstack((ground_truth*0, ground_truth*255, ground_truth*0)).astype(np.float32)
+
+# Define RoverState() class to retain rover state parameters.
+# The attributes are fixed with __slots__, and the per frame arrays are sized once for
+# camera images of image_shape: perception writes the camera image classification into
+# vision_image and the polar coordinates of the navigable and rock pixels into nav_buffer
+# and rock_buffer, with nav_angles, nav_dists, rock_angles and rock_dists views of them.
+# Keep a copy of those views (or of the whole state, with copy()) to hold on to them past
+# the next frame.
+# The worldmap covers map_extent meters on each side in cells of 1/map_resolution meters,
+# with counts of map_dtype.
+class RoverState():
+    __slots__ = ('start_time', 'start_pos', 'total_time', 'img', 'pos', 'yaw', 'pitch', 'roll', 'vel',
+                 'steer', 'throttle', 'brake', 'nav_angles', 'nav_dists', 'nav_buffer', 'rock_buffer',
+                 'rock_angles', 'rock_dists', 'stuck_yaw', 'ground_truth', 'mode', 'throttle_set',
+                 'throttle_one_eighth', 'throttle_quarter', 'throttle_three_quarters', 'throttle_crawl',
+                 'throttle_full', 'brake_set', 'stop_forward', 'go_forward', 'max_vel', 'rock_approach_vel',
+                 'vision_image', 'worldmap', 'map_stats', 'planner', 'explorer', 'samples_pos',
+                 'detected_samples', 'current_sample_pos', 'samples_to_find', 'samples_found', 'near_sample',
+                 'picking_up', 'send_pickup', 'stuck_frames', 'unstuck_frames', 'low_forward_frames',
+                 'zero_vel_frames', 'max_steer_frames', 'try_home_frames', 'dance_frames', 'increment',
+                 'distance_to_start', 'ready_for_home', 'recover_yaw', 'recover_pos')
+
+    def __init__(self, ground_truth=ground_truth_3d, image_shape=(160, 320), map_resolution=1, map_extent=200,
+                 map_dtype=np.uint32):
+        self.start_time = None # To record the start time of navigation
+        self.start_pos = None
+        self.total_time = None # To record total duration of naviagation
+        self.img = None # Current camera image
+        self.pos = None # Current position (x, y)
+        self.yaw = None # Current yaw angle
+        self.pitch = None # Current pitch angle
+        self.roll = None # Current roll angle
+        self.vel = None # Current velocity
+        self.steer = 0 # Current steering angle
+        self.throttle = 0 # Current throttle value
+        self.brake = 0 # Current brake value
+        self.nav_angles = None # Angles of navigable terrain pixels
+        self.nav_dists = None # Distances of navigable terrain pixels
+        # Angles (row 0) and distances (row 1) of the navigable and rock pixels of the current frame
+        self.nav_buffer = np.zeros((2, image_shape[0] * image_shape[1]), dtype=np.float32)
+        self.rock_buffer = np.zeros((2, image_shape[0] * image_shape[1]), dtype=np.float32)
+        
+        ####
+        self.rock_angles = None # Angles of rock object
+        self.rock_dists = None # Distances of rock object
+        ####
+
+        self.stuck_yaw = None
+        
+        self.ground_truth = ground_truth # Ground truth worldmap
+        self.mode = 'forward' # Current mode (can be forward or stop), need other modes?
+        self.throttle_set = 0.35 # Throttle setting when accelerating
+        self.throttle_one_eighth = 0.125
+        self.throttle_quarter = 0.25
+        self.throttle_three_quarters = 0.75
+        self.throttle_crawl = 0.15
+        self.throttle_full = 1.0
+        self.brake_set = 10 # Brake setting when braking
+        # The stop_forward and go_forward fields below represent total count
+        # of navigable terrain pixels.  This is a very crude form of knowing
+        # when you can keep going and when you should stop.  Feel free to
+        # get creative in adding new fields or modifying these!
+        self.stop_forward = 50 # Threshold to initiate stopping
+        self.go_forward = 500 # Threshold to go forward again
+        self.max_vel = 1.6 # Maximum velocity (meters/second)
+        self.rock_approach_vel = 0.5
+        # Image output from perception step
+        # Update this image to display your intermediate analysis steps
+        # on screen in autonomous mode
+        self.vision_image = np.zeros(tuple(image_shape) + (3,), dtype=np.uint8)
+        # Worldmap
+        # Update this map with the positions of navigable terrain
+        # obstacles and rock samples
+        self.worldmap = WorldMap(int(map_extent * map_resolution), map_dtype, resolution=map_resolution)
+        # Statistics shown on screen, kept up to date as the worldmap changes
+        self.map_stats = MapStatistics(self.worldmap, self.ground_truth)
+        # Plans the paths home and to known rock samples
+        self.planner = GridPlanner(self.worldmap)
+        # Chooses where to explore in forward mode, the rover hugs the left wall without one
+        self.explorer = None
+        self.samples_pos = None # To store the actual sample positions
+        self.detected_samples = SampleIndex() # To store the positions of the samples detected
+        self.current_sample_pos = None # To store the position of the sample currently being collected
+        self.samples_to_find = 0 # To store the initial count of samples
+        self.samples_found = 0 # To count the number of samples found
+        self.near_sample = 0 # Will be set to telemetry value data["near_sample"]
+        self.picking_up = 0 # Will be set to telemetry value data["picking_up"]
+        self.send_pickup = False # Set to True to trigger rock pickup
+
+        self.stuck_frames = 0  # Number of frames the rover is stuck.
+        self.unstuck_frames = 0  # Number of frames the rover is in circling pattern
+        self.low_forward_frames = 0  # Number of frames the rover is
+        self.zero_vel_frames = 0
+        self.max_steer_frames = 0
+        self.try_home_frames = 0
+        self.dance_frames = 0
+        self.increment = True
+        self.distance_to_start = 0
+
+        self.ready_for_home = False
+
+        self.recover_yaw = None
+        self.recover_pos = None
+
+    # Return a copy of the state that does not share any array or the worldmap with it,
+    # e.g. to keep the state of a replayed frame. The ground truth map is shared, it is
+    # never modified.
+    def copy(self):
+        clone = RoverState.__new__(RoverState)
+        for name in RoverState.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, np.ndarray) and value is not self.ground_truth:
+                value = value.copy()
+            elif isinstance(value, list):
+                value = list(value)
+            setattr(clone, name, value)
+        clone.detected_samples = self.detected_samples.copy()
+        clone.worldmap = self.worldmap.copy()
+        clone.map_stats = MapStatistics(clone.worldmap, clone.ground_truth)
+        clone.planner = GridPlanner(clone.worldmap)
+        if self.explorer is not None:
+            clone.explorer = FrontierExplorer(clone.worldmap)
+        return clone
+
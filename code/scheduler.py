@@ -0,0 +1,75 @@
+import time
+
+from perception import perception_step
+
+# Kinds of perception pass the scheduler chooses between
+FULL = 'full'
+REDUCED = 'reduced'
+REUSE = 'reuse'
+
+# Define a class deciding for every frame how much perception work to do:
+#  - reuse: the rover has not moved or turned since the last pass (velocity under still_vel
+#    and yaw within yaw_tolerance degrees), the camera sees the same scene so the last
+#    results are kept, for at most max_reuse frames in a row
+#  - reduced: the rover is in one of reduced_modes, or the host is saturated (the recent
+#    perception time is over budget seconds), a reduced resolution pass on a grid downsampled
+#    by reduced_downsample only updates the polar coordinates the decision step needs, for at
+#    most max_reduced frames in a row so the map keeps growing
+#  - full: anything else, the full perception step on a grid downsampled by downsample
+# The default policy only skips work that could not change the results; a budget has to
+# be given for the load based degradation. See perception_step for the downsampling.
+class PerceptionScheduler():
+    def __init__(self, still_vel=0.05, yaw_tolerance=0.5, max_reuse=10, reduced_modes=('home_dance',),
+                 budget=0, max_reduced=3, smoothing=0.9, downsample=1, reduced_downsample=2):
+        self.still_vel = still_vel
+        self.yaw_tolerance = yaw_tolerance
+        self.max_reuse = max_reuse
+        self.reduced_modes = reduced_modes
+        self.budget = budget
+        self.max_reduced = max_reduced
+        self.smoothing = smoothing
+        self.downsample = downsample
+        # Reduced passes are never finer than full ones
+        self.reduced_downsample = max(reduced_downsample, downsample)
+        # Exponential moving average of the full perception time
+        self.load = 0
+        # Yaw at the last pass and number of passes of the same kind in a row
+        self.last_yaw = None
+        self.reused = 0
+        self.reduced = 0
+        # Number of frames of each kind
+        self.counts = {FULL: 0, REDUCED: 0, REUSE: 0}
+
+    # Decide the kind of pass for the current Rover state
+    def decide(self, Rover):
+        if self.last_yaw is None or Rover.nav_angles is None:
+            return FULL
+        yaw_change = abs((Rover.yaw - self.last_yaw + 180) % 360 - 180)
+        if abs(Rover.vel) < self.still_vel and yaw_change < self.yaw_tolerance and self.reused < self.max_reuse:
+            return REUSE
+        if self.reduced < self.max_reduced:
+            if Rover.mode in self.reduced_modes:
+                return REDUCED
+            if self.budget > 0 and self.load > self.budget:
+                return REDUCED
+        return FULL
+
+    # Run the perception pass chosen for the current Rover state
+    def step(self, Rover):
+        kind = self.decide(Rover)
+        self.counts[kind] += 1
+        if kind == REUSE:
+            self.reused += 1
+            return Rover
+        self.reused = 0
+        if kind == REDUCED:
+            self.reduced += 1
+            Rover = perception_step(Rover, reduced=True, downsample=self.reduced_downsample)
+        else:
+            self.reduced = 0
+            started = time.perf_counter()
+            Rover = perception_step(Rover, downsample=self.downsample)
+            elapsed = time.perf_counter() - started
+            self.load = self.smoothing * self.load + (1 - self.smoothing) * elapsed
+        self.last_yaw = Rover.yaw
+        return Rover
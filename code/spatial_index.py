@@ -0,0 +1,98 @@
+import numpy as np
+
+# Define a class indexing 2D points (e.g. rock sample positions in world coordinates) in a
+# grid hash: points are bucketed by the cell_size x cell_size cell they fall in, so a radius
+# query only looks at the points of the cells within reach instead of all of them.
+# Points are added one at a time and never removed.
+class SampleIndex():
+    def __init__(self, cell_size=5.0, capacity=16):
+        self.cell_size = float(cell_size)
+        # Cell -> indices of the points in it
+        self.cells = {}
+        # Point coordinates, grown by doubling
+        self.points = np.zeros((capacity, 2))
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    # Coordinates of the points added so far
+    @property
+    def xy(self):
+        return self.points[:self.count]
+
+    # Return an index of the same points that can be added to independently
+    def copy(self):
+        clone = SampleIndex(self.cell_size)
+        clone.cells = {cell: list(indices) for cell, indices in self.cells.items()}
+        clone.points = self.points.copy()
+        clone.count = self.count
+        return clone
+
+    def cell(self, x, y):
+        return int(np.floor(x / self.cell_size)), int(np.floor(y / self.cell_size))
+
+    # Add a point, returning its index
+    def insert(self, x, y):
+        if self.count == len(self.points):
+            self.points = np.concatenate((self.points, np.zeros_like(self.points)))
+        idx = self.count
+        self.points[idx] = (x, y)
+        self.count += 1
+        self.cells.setdefault(self.cell(x, y), []).append(idx)
+        return idx
+
+    # Add a point unless there is one within radius already. Returns the index of the new
+    # point, or None if it was not added.
+    def insert_unique(self, x, y, radius):
+        if self.nearest(x, y, radius) is not None:
+            return None
+        return self.insert(x, y)
+
+    # Indices of the points in the cells within reach cells of a cell
+    def candidates(self, cell, reach):
+        found = []
+        for cell_x in range(cell[0] - reach, cell[0] + reach + 1):
+            for cell_y in range(cell[1] - reach, cell[1] + reach + 1):
+                found.extend(self.cells.get((cell_x, cell_y), ()))
+        return found
+
+    # Return the index of the point nearest to (x, y) if it is closer than radius, else None
+    def nearest(self, x, y, radius):
+        candidates = self.candidates(self.cell(x, y), int(np.ceil(radius / self.cell_size)))
+        if len(candidates) == 0:
+            return None
+        dists = np.hypot(self.points[candidates, 0] - x, self.points[candidates, 1] - y)
+        closest = np.argmin(dists)
+        if dists[closest] < radius:
+            return candidates[closest]
+        return None
+
+    # Return the pairs of query points and indexed points closer than radius, as an array of
+    # query point indices and an array of indexed point indices. The query points are grouped
+    # by cell, so there is one candidate lookup per cell rather than per query point.
+    def pairs_within(self, xs, ys, radius):
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        if self.count == 0 or len(xs) == 0:
+            return np.zeros(0, dtype=np.int_), np.zeros(0, dtype=np.int_)
+        reach = int(np.ceil(radius / self.cell_size))
+        keys = np.stack((np.floor(xs / self.cell_size), np.floor(ys / self.cell_size)), axis=1).astype(np.int_)
+        cells, inverse = np.unique(keys, axis=0, return_inverse=True)
+        order = np.argsort(inverse.ravel(), kind='stable')
+        groups = np.split(order, np.cumsum(np.bincount(inverse.ravel(), minlength=len(cells)))[:-1])
+        query_found = []
+        point_found = []
+        for cell, members in zip(cells, groups):
+            candidates = self.candidates(tuple(cell), reach)
+            if len(candidates) == 0:
+                continue
+            candidates = np.array(candidates)
+            dists = np.hypot(xs[members, None] - self.points[candidates, 0],
+                             ys[members, None] - self.points[candidates, 1])
+            query_hit, point_hit = np.nonzero(dists < radius)
+            query_found.append(members[query_hit])
+            point_found.append(candidates[point_hit])
+        if len(query_found) == 0:
+            return np.zeros(0, dtype=np.int_), np.zeros(0, dtype=np.int_)
+        return np.concatenate(query_found), np.concatenate(point_found)
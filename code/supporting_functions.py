@@ -1,19 +1,50 @@
 import numpy as np
 import cv2
-from PIL import Image
-from io import BytesIO, StringIO
+from collections import namedtuple
 import base64
+import logging
 import time
 
+logger = logging.getLogger('rover')
+
 # Define a function to convert telemetry strings to float independent of decimal convention
 def convert_to_float(string_to_convert):
-      if ',' in string_to_convert:
-            float_value = np.float(string_to_convert.replace(',','.'))
-      else: 
-            float_value = np.float(string_to_convert)
-      return float_value
+      return float(string_to_convert.replace(',','.'))
+
+# Fields of a telemetry packet
+Telemetry = namedtuple('Telemetry', ['vel', 'pos', 'yaw', 'pitch', 'roll', 'throttle', 'steer',
+                                     'near_sample', 'picking_up', 'sample_count', 'img'])
+
+# Define a class to parse telemetry packets from the simulator.
+# The camera image is decoded straight to RGB, without a separate color conversion pass.
+# cv2.imdecode cannot decode into an existing array, so each frame gets a new image.
+class TelemetryDecoder():
+      # Decode a base64 JPEG string into an RGB image
+      def decode_image(self, image_string):
+            buff = np.frombuffer(base64.b64decode(image_string), dtype=np.uint8)
+            return cv2.imdecode(buff, cv2.IMREAD_COLOR_RGB)
+
+      # Parse a telemetry packet, the camera image is only decoded with decode_image set
+      def decode(self, data, decode_image=True):
+            xpos, ypos = data["position"].split(';')
+            return Telemetry(vel=convert_to_float(data["speed"]),
+                             pos=[convert_to_float(xpos), convert_to_float(ypos)],
+                             yaw=convert_to_float(data["yaw"]),
+                             pitch=convert_to_float(data["pitch"]),
+                             roll=convert_to_float(data["roll"]),
+                             throttle=convert_to_float(data["throttle"]),
+                             steer=convert_to_float(data["steering_angle"]),
+                             near_sample=int(data["near_sample"]),
+                             picking_up=int(data["picking_up"]),
+                             sample_count=int(data["sample_count"]),
+                             img=self.decode_image(data["image"]) if decode_image else None)
 
-def update_rover(Rover, data):
+# Decoder used by update_rover
+telemetry_decoder = TelemetryDecoder()
+
+# Define a function to update the Rover state with a telemetry packet. Without decode_image
+# the camera image is left to be decoded elsewhere, and None is returned for it.
+def update_rover(Rover, data, decode_image=True):
       # Initialize start time and sample positions
       if Rover.start_time == None:
             Rover.start_time = time.time()
@@ -21,134 +52,145 @@ def update_rover(Rover, data):
             samples_xpos = np.int_([convert_to_float(pos.strip()) for pos in data["samples_x"].split(';')])
             samples_ypos = np.int_([convert_to_float(pos.strip()) for pos in data["samples_y"].split(';')])
             Rover.samples_pos = (samples_xpos, samples_ypos)
-            Rover.samples_to_find = np.int(data["sample_count"])
+            Rover.samples_to_find = int(data["sample_count"])
       # Or just update elapsed time
       else:
             tot_time = time.time() - Rover.start_time
             if np.isfinite(tot_time):
                   Rover.total_time = tot_time
-      # Print out the fields in the telemetry data dictionary
-      print(data.keys())
+      # Log the fields in the telemetry data dictionary
+      logger.debug('%s', data.keys())
+      telemetry = telemetry_decoder.decode(data, decode_image)
       # The current speed of the rover in m/s
-      Rover.vel = convert_to_float(data["speed"])
+      Rover.vel = telemetry.vel
       # The current position of the rover
-      Rover.pos = [convert_to_float(pos.strip()) for pos in data["position"].split(';')]
+      Rover.pos = telemetry.pos
       # The current yaw angle of the rover
-      Rover.yaw = convert_to_float(data["yaw"])
+      Rover.yaw = telemetry.yaw
       # The current yaw angle of the rover
-      Rover.pitch = convert_to_float(data["pitch"])
+      Rover.pitch = telemetry.pitch
       # The current yaw angle of the rover
-      Rover.roll = convert_to_float(data["roll"])
+      Rover.roll = telemetry.roll
       # The current throttle setting
-      Rover.throttle = convert_to_float(data["throttle"])
+      Rover.throttle = telemetry.throttle
       # The current steering angle
-      Rover.steer = convert_to_float(data["steering_angle"])
+      Rover.steer = telemetry.steer
       # Near sample flag
-      Rover.near_sample = np.int(data["near_sample"])
+      Rover.near_sample = telemetry.near_sample
       # Picking up flag
-      Rover.picking_up = np.int(data["picking_up"])
+      Rover.picking_up = telemetry.picking_up
       # Update number of rocks found
-      Rover.samples_found = Rover.samples_to_find - np.int(data["sample_count"])
+      Rover.samples_found = Rover.samples_to_find - telemetry.sample_count
 
-      print('mode = ', Rover.mode, 'speed =', Rover.vel, 'position =', Rover.pos, 'throttle =',
-      Rover.throttle, 'steer_angle =', Rover.steer, 'near_sample:', Rover.near_sample, 
-      'picking_up:', data["picking_up"], 'sending pickup:', Rover.send_pickup, 
-      'total time:', Rover.total_time, 'samples remaining:', data["sample_count"], 
-      'samples found:', Rover.samples_found)
+      if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('mode = %s speed = %s position = %s throttle = %s steer_angle = %s near_sample: %s '
+                         'picking_up: %s sending pickup: %s total time: %s samples remaining: %s '
+                         'samples found: %s', Rover.mode, Rover.vel, Rover.pos, Rover.throttle, Rover.steer,
+                         Rover.near_sample, Rover.picking_up, Rover.send_pickup, Rover.total_time,
+                         telemetry.sample_count, Rover.samples_found)
       # Get the current image from the center camera of the rover
-      imgString = data["image"]
-      image = Image.open(BytesIO(base64.b64decode(imgString)))
-      Rover.img = np.asarray(image)
+      if decode_image:
+            Rover.img = telemetry.img
 
       # Return updated Rover and separate image for optional saving
-      return Rover, image
+      return Rover, telemetry.img
 
-# Define a function to create display output given worldmap results
-def create_output_images(Rover):
+# Define a class holding what is needed to draw the output images, copied from the
+# Rover state so that they can be drawn later or on another thread while the Rover
+# state keeps changing
+class HudSnapshot():
+      def __init__(self, Rover):
+            # Map statistics are kept up to date as the worldmap changes
+            stats = Rover.map_stats
+            # Only the allocated tiles of the worldmap are copied, it is assembled into a
+            # dense map when drawing
+            self.worldmap = Rover.worldmap.copy()
+            self.nav_mean = stats.mean(2)
+            self.obs_mean = stats.mean(0)
+            self.ground_truth = Rover.ground_truth
+            self.vision_image = Rover.vision_image.copy()
+            # If there are rock detections in the worldmap, step through the known
+            # sample positions to confirm whether detections are real
+            self.located_samples = []
+            if Rover.worldmap.count_nonzero(1) > 0 and Rover.samples_pos is not None:
+                  located = stats.located_samples(Rover.worldmap, Rover.samples_pos)
+                  for idx in np.flatnonzero(located):
+                        self.located_samples.append((Rover.samples_pos[0][idx], Rover.samples_pos[1][idx]))
+            self.total_time = Rover.total_time
+            # Calculate the percentage of ground truth map that has been successfully found
+            self.perc_mapped = stats.perc_mapped()
+            # Calculate the number of good map pixel detections divided by total pixels 
+            # found to be navigable terrain
+            self.fidelity = stats.fidelity()
+            self.samples_found = Rover.samples_found
+            # Distinct rock samples seen so far, detections within 5 meters count once
+            self.samples_detected = len(Rover.detected_samples)
+            self.distance_to_start = Rover.distance_to_start
+
+# Define a function to encode an RGB image as a base64 JPEG string
+def encode_image(img):
+      _, buff = cv2.imencode('.jpg', cv2.cvtColor(img, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 75])
+      return base64.b64encode(buff).decode("utf-8")
+
+# Define a function to draw and encode the output images of a HUD snapshot
+def render_output_images(snapshot):
+
+      # The worldmap is drawn at the 1 meter resolution of the ground truth map
+      view = snapshot.worldmap.view(snapshot.worldmap.resolution)
+      rows, cols = snapshot.ground_truth.shape[:2]
+      worldmap = np.zeros((rows, cols, 3), dtype=view.dtype)
+      worldmap[:min(rows, view.shape[0]), :min(cols, view.shape[1])] = view[:rows, :cols]
 
       # Create a scaled map for plotting and clean up obs/nav pixels a bit
-      if np.max(Rover.worldmap[:,:,2]) > 0:
-            nav_pix = Rover.worldmap[:,:,2] > 0
-            navigable = Rover.worldmap[:,:,2] * (255 / np.mean(Rover.worldmap[nav_pix, 2]))
+      if snapshot.nav_mean > 0:
+            navigable = worldmap[:,:,2].astype(np.float32) * (255 / snapshot.nav_mean)
       else: 
-            navigable = Rover.worldmap[:,:,2]
-      if np.max(Rover.worldmap[:,:,0]) > 0:
-            obs_pix = Rover.worldmap[:,:,0] > 0
-            obstacle = Rover.worldmap[:,:,0] * (255 / np.mean(Rover.worldmap[obs_pix, 0]))
+            navigable = worldmap[:,:,2].astype(np.float32)
+      if snapshot.obs_mean > 0:
+            obstacle = worldmap[:,:,0].astype(np.float32) * (255 / snapshot.obs_mean)
       else:
-            obstacle = Rover.worldmap[:,:,0]
+            obstacle = worldmap[:,:,0].astype(np.float32)
 
       likely_nav = navigable >= obstacle
       obstacle[likely_nav] = 0
-      plotmap = np.zeros_like(Rover.worldmap)
+      plotmap = np.zeros(worldmap.shape, dtype=np.float32)
       plotmap[:, :, 0] = obstacle
       plotmap[:, :, 2] = navigable
       plotmap = plotmap.clip(0, 255)
       # Overlay obstacle and navigable terrain map with ground truth map
-      map_add = cv2.addWeighted(plotmap, 1, Rover.ground_truth, 0.5, 0)
-
-      # Check whether any rock detections are present in worldmap
-      rock_world_pos = Rover.worldmap[:,:,1].nonzero()
-      # If there are, we'll step through the known sample positions
-      # to confirm whether detections are real
-      if rock_world_pos[0].any():
-            rock_size = 2
-            for idx in range(len(Rover.samples_pos[0])):
-                  test_rock_x = Rover.samples_pos[0][idx]
-                  test_rock_y = Rover.samples_pos[1][idx]
-                  rock_sample_dists = np.sqrt((test_rock_x - rock_world_pos[1])**2 + \
-                                        (test_rock_y - rock_world_pos[0])**2)
-                  # If rocks were detected within 3 meters of known sample positions
-                  # consider it a success and plot the location of the known
-                  # sample on the map
-                  if np.min(rock_sample_dists) < 3:
-                        map_add[test_rock_y-rock_size:test_rock_y+rock_size, 
-                        test_rock_x-rock_size:test_rock_x+rock_size, :] = 255
-
-      # Calculate some statistics on the map results
-      # First get the total number of pixels in the navigable terrain map
-      tot_nav_pix = np.float(len((plotmap[:,:,2].nonzero()[0])))
-      # Next figure out how many of those correspond to ground truth pixels
-      good_nav_pix = np.float(len(((plotmap[:,:,2] > 0) & (Rover.ground_truth[:,:,1] > 0)).nonzero()[0]))
-      # Next find how many do not correspond to ground truth pixels
-      bad_nav_pix = np.float(len(((plotmap[:,:,2] > 0) & (Rover.ground_truth[:,:,1] == 0)).nonzero()[0]))
-      # Grab the total number of map pixels
-      tot_map_pix = np.float(len((Rover.ground_truth[:,:,1].nonzero()[0])))
-      # Calculate the percentage of ground truth map that has been successfully found
-      perc_mapped = round(100*good_nav_pix/tot_map_pix, 1)
-      # Calculate the number of good map pixel detections divided by total pixels 
-      # found to be navigable terrain
-      if tot_nav_pix > 0:
-            fidelity = round(100*good_nav_pix/(tot_nav_pix), 1)
-      else:
-            fidelity = 0
+      map_add = cv2.addWeighted(plotmap, 1, snapshot.ground_truth, 0.5, 0)
+
+      # Rocks were detected within 3 meters of these known sample positions,
+      # consider it a success and plot the location of the known sample on the map
+      rock_size = 2
+      for test_rock_x, test_rock_y in snapshot.located_samples:
+            map_add[test_rock_y-rock_size:test_rock_y+rock_size, 
+            test_rock_x-rock_size:test_rock_x+rock_size, :] = 255
+
       # Flip the map for plotting so that the y-axis points upward in the display
-      map_add = np.flipud(map_add).astype(np.float32)
+      map_add = np.flipud(map_add).astype(np.uint8)
       # Add some text about map and rock sample detection results
-      cv2.putText(map_add,"Time: "+str(np.round(Rover.total_time, 1))+' s', (0, 10), 
+      cv2.putText(map_add,"Time: "+str(np.round(snapshot.total_time, 1))+' s', (0, 10), 
                   cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-      cv2.putText(map_add,"Mapped: "+str(perc_mapped)+'%', (0, 25), 
+      cv2.putText(map_add,"Mapped: "+str(snapshot.perc_mapped)+'%', (0, 25), 
                   cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-      cv2.putText(map_add,"Fidelity: "+str(fidelity)+'%', (0, 40), 
+      cv2.putText(map_add,"Fidelity: "+str(snapshot.fidelity)+'%', (0, 40), 
                   cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-      cv2.putText(map_add,"Rocks: "+str(Rover.samples_found), (0, 55), 
+      cv2.putText(map_add,"Rocks: "+str(snapshot.samples_found)+' ('+str(snapshot.samples_detected)+' seen)', (0, 55), 
                   cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
 
-      cv2.putText(map_add,"Home: "+str(Rover.distance_to_start), (0, 70),
+      cv2.putText(map_add,"Home: "+str(snapshot.distance_to_start), (0, 70),
                   cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
 
       # Convert map and vision image to base64 strings for sending to server
-      pil_img = Image.fromarray(map_add.astype(np.uint8))
-      buff = BytesIO()
-      pil_img.save(buff, format="JPEG")
-      encoded_string1 = base64.b64encode(buff.getvalue()).decode("utf-8")
-      
-      pil_img = Image.fromarray(Rover.vision_image.astype(np.uint8))
-      buff = BytesIO()
-      pil_img.save(buff, format="JPEG")
-      encoded_string2 = base64.b64encode(buff.getvalue()).decode("utf-8")
+      encoded_string1 = encode_image(map_add)
+      encoded_string2 = encode_image(snapshot.vision_image)
 
       return encoded_string1, encoded_string2
 
+# Define a function to create display output given worldmap results
+def create_output_images(Rover):
+      return render_output_images(HudSnapshot(Rover))
+
 def distance_between(position_a, position_b):
     return np.sqrt((position_a[0] - position_b[0])**2 + (position_a[1] - position_b[1])**2)
@@ -0,0 +1,329 @@
+import numpy as np
+import pytest
+
+from decision import DecisionMachine, drive_towards, is_stuck, steer_within_terrain
+from frontier import FrontierExplorer
+from rover_state import RoverState
+from supporting_functions import distance_between
+
+# The decision state machine is checked against the decision tree it replaced, kept below
+# as it was, on random Rover states: two rovers get the same inputs every frame, one is
+# driven by the tree and the other by the machine, and their commands, modes and counters
+# have to be the same. The planners search without a time limit so the paths they plan do
+# not depend on how fast the test runs.
+
+MODES = ['forward', 'stop', 'pickup', 'unstuck', 'home', 'home_dance']
+# Fields set by the decisions, compared after every frame
+FIELDS = ['mode', 'throttle', 'brake', 'steer', 'send_pickup', 'current_sample_pos', 'stuck_frames',
+          'unstuck_frames', 'low_forward_frames', 'max_steer_frames', 'try_home_frames', 'dance_frames',
+          'increment', 'distance_to_start', 'ready_for_home', 'go_forward', 'start_pos', 'stuck_yaw']
+
+
+# The decision tree replaced by DecisionMachine
+def reference_step(Rover):
+    # We are home, lets dance.
+    if Rover.mode == 'home_dance':
+        if Rover.vel > 0:
+            Rover.brake = Rover.brake_set
+            Rover.steer = 0
+            Rover.throttle = 0
+        elif Rover.increment and Rover.dance_frames <= 20:
+            Rover.steer = -15
+            Rover.dance_frames += 1
+            Rover.brake = 0
+            Rover.throttle = 0
+            if Rover.dance_frames > 20:
+                Rover.increment = False
+        else:
+            Rover.steer = 15
+            Rover.dance_frames -= 1
+            Rover.brake = 0
+            Rover.throttle = 0
+            if Rover.dance_frames < 0:
+                Rover.increment = True
+        return Rover
+
+    # Check if we have vision of a rock and make decisions
+    if Rover.rock_angles is not None and len(Rover.rock_angles) > 1:
+        # Begin stopping
+        if Rover.mode != 'pickup':
+            Rover.throttle = 0
+            Rover.brake = 3
+            Rover.steer = 0
+            Rover.mode = 'pickup'
+
+    # We are getting unstuck going home.
+    if Rover.try_home_frames > 0:
+        Rover.try_home_frames -= 1
+        if Rover.try_home_frames <= 0:
+            Rover.mode = 'home'
+
+    # Reduce the number of forward pixels when stuck for long
+    if Rover.mode == 'unstuck' or Rover.mode == 'stop':
+        Rover.unstuck_frames += 1
+        if Rover.unstuck_frames > 500:
+            Rover.go_forward = 100
+    else:
+        Rover.unstuck_frames = 0
+
+    # Reset the go_forward threshold.
+    if Rover.go_forward == 100:
+        Rover.low_forward_frames += 1
+        if Rover.low_forward_frames >= 500:
+            Rover.go_forward = 500
+    else:
+        Rover.low_forward_frames = 0
+
+    # Safe guard against going in circles
+    if Rover.mode == 'forward' \
+            and not Rover.picking_up \
+            and (Rover.steer > 13.5 or Rover.steer < -13.5) \
+            and Rover.vel > 0.2:
+        Rover.max_steer_frames += 1
+        if Rover.max_steer_frames > 500:
+            Rover.mode = 'unstuck'
+            Rover.brake = 0
+            Rover.steer = 0
+            Rover.throttle = 0
+            Rover.stuck_yaw = Rover.yaw
+    else:
+        Rover.max_steer_frames = 0
+
+    # Set the starting position.
+    if Rover.start_pos is None:
+        Rover.start_pos = Rover.pos
+        Rover.recover_pos = Rover.pos
+        Rover.recover_yaw = Rover.yaw
+    else:
+        #  Check if we are near the start.
+        distance_to_start = distance_between(Rover.pos, Rover.start_pos)
+        Rover.distance_to_start = distance_to_start
+        map_filled = Rover.worldmap.count_nonzero()
+        if not Rover.mode == 'unstuck' and map_filled > 7000 and distance_to_start < 5:
+            Rover.ready_for_home = True
+            if Rover.try_home_frames <= 0:
+                Rover.mode = 'home'
+
+    if Rover.nav_angles is not None:
+        if is_stuck(Rover):
+            Rover.stuck_frames += 1
+            if Rover.stuck_frames > 50:
+                Rover.throttle = 0
+                Rover.brake = 0
+                Rover.steer = 0
+                Rover.stuck_yaw = Rover.yaw
+                Rover.mode = 'unstuck'
+                if Rover.ready_for_home:
+                    Rover.try_home_frames = 500
+        else:
+            Rover.stuck_frames = 0
+
+        if Rover.mode == 'forward':
+            if len(Rover.nav_angles) >= Rover.stop_forward:
+                if Rover.vel < Rover.max_vel:
+                    Rover.throttle = Rover.throttle_set
+                else:
+                    Rover.throttle = 0
+                Rover.brake = 0
+                target = Rover.explorer.target(Rover.pos) if Rover.explorer is not None else None
+                if target is not None:
+                    Rover.steer = steer_within_terrain(Rover, target)
+                else:
+                    Rover.steer = np.clip(np.mean(Rover.nav_angles * 180/np.pi) + 14, -15, 15)
+            elif len(Rover.nav_angles) < Rover.stop_forward:
+                Rover.throttle = 0
+                Rover.brake = Rover.brake_set
+                Rover.steer = 0
+                Rover.mode = 'stop'
+        elif Rover.mode == 'stop':
+            if Rover.vel > 0.2:
+                Rover.throttle = 0
+                Rover.brake = Rover.brake_set
+                Rover.steer = 0
+            elif Rover.vel <= 0.2:
+                if len(Rover.nav_angles) < Rover.go_forward:
+                    Rover.throttle = 0
+                    Rover.brake = 0
+                    Rover.steer = -15
+                if len(Rover.nav_angles) >= Rover.go_forward:
+                    Rover.throttle = Rover.throttle_set
+                    Rover.brake = 0
+                    Rover.steer = np.clip(np.mean(Rover.nav_angles * 180/np.pi), -15, 15)
+                    Rover.mode = 'forward'
+        elif Rover.mode == 'pickup':
+            if Rover.vel == 0 and not Rover.picking_up and Rover.near_sample:
+                Rover.send_pickup = True
+            if Rover.picking_up:
+                Rover.mode = 'forward'
+                Rover.current_sample_pos = None
+            else:
+                if Rover.rock_angles is not None and len(Rover.rock_angles) > 1:
+                    rock_distance = np.mean(Rover.rock_dists)
+                    if Rover.near_sample:
+                        Rover.throttle = 0
+                        Rover.brake = Rover.brake_set
+                        Rover.steer = 0
+                    elif rock_distance < 15:
+                        if Rover.vel < Rover.rock_approach_vel:
+                            Rover.throttle = Rover.throttle_crawl
+                            Rover.brake = 0
+                        else:
+                            Rover.throttle = 0
+                            Rover.brake = 8
+                        Rover.steer = np.clip(np.mean(Rover.rock_angles * 180/np.pi) - 10, -15, 15)
+                    else:
+                        if Rover.vel < Rover.rock_approach_vel:
+                            Rover.throttle = Rover.throttle_crawl
+                        else:
+                            Rover.throttle = 0
+                            Rover.brake = 6
+                        Rover.steer = np.clip(np.mean(Rover.rock_angles * 180/np.pi) - 10, -15, 15)
+                        Rover.brake = 0
+                elif Rover.current_sample_pos is not None:
+                    rock_distance = distance_between(Rover.current_sample_pos, Rover.pos)
+                    if Rover.near_sample:
+                        Rover.throttle = 0
+                        Rover.brake = Rover.brake_set
+                        Rover.steer = 0
+                    elif rock_distance > 1:
+                        waypoint = Rover.planner.next_waypoint(Rover.pos, Rover.current_sample_pos)
+                        drive_towards(Rover, waypoint, Rover.throttle_crawl, Rover.rock_approach_vel)
+                    else:
+                        Rover.steer = 0
+                        Rover.throttle = 0
+                        Rover.brake = 0
+                        Rover.mode = 'forward'
+                else:
+                    Rover.brake = Rover.brake_set
+                    Rover.steer = 0
+                    Rover.throttle = 0
+                    Rover.current_sample_pos = None
+                    Rover.mode = 'forward'
+        elif Rover.mode == 'unstuck':
+            Rover.throttle = 0
+            Rover.brake = 0
+            Rover.steer = - 15
+            if abs(Rover.yaw - Rover.stuck_yaw) > 10:
+                Rover.mode = 'stop'
+        elif Rover.mode == 'home':
+            if Rover.distance_to_start < 1:
+                Rover.brake = Rover.brake_set
+                Rover.steer = 0
+                Rover.throttle = 0
+                Rover.mode = 'home_dance'
+            else:
+                waypoint = Rover.planner.next_waypoint(Rover.pos, Rover.start_pos)
+                drive_towards(Rover, waypoint, Rover.throttle_quarter, Rover.max_vel)
+    else:
+        Rover.throttle = Rover.throttle_set
+        Rover.steer = 0
+        Rover.brake = 0
+    return Rover
+
+
+# Return a rover whose planners search without a time limit
+def make_rover(explore):
+    Rover = RoverState()
+    Rover.planner.frame_budget = np.inf
+    if explore:
+        Rover.explorer = FrontierExplorer(Rover.worldmap)
+        Rover.explorer.planner.frame_budget = np.inf
+    return Rover
+
+
+# Return the flat cell indices of a square of cells around a position in meters
+def square(pos, side):
+    x, y = np.meshgrid(np.arange(side) - side // 2 + int(pos[0]), np.arange(side) - side // 2 + int(pos[1]))
+    return (y * 200 + x).ravel()
+
+
+# Yield random inputs of a frame as (field, value) pairs. The rover wanders around its
+# start, the map fills up from frame 800 so that it can go home, and the mode is forced
+# every now and then so every mode is run often.
+def random_inputs(rng, frames):
+    start = np.array([100.0, 100.0])
+    pos = start.copy()
+    yaw = 0.0
+    vel = 0.0
+    sample_pos = None
+    for idx in range(frames):
+        inputs = []
+        pos = np.clip(pos + rng.normal(0, 0.3, 2), 80, 120)
+        if rng.random() < 0.02:
+            # Back near the start
+            pos = start + rng.uniform(-1.5, 1.5, 2)
+        yaw = (yaw + rng.normal(0, 3)) % 360
+        if rng.random() < 0.05:
+            yaw = (yaw + rng.choice([-15, 15])) % 360
+        if rng.random() < 0.2:
+            vel = float(rng.choice([0, 0.05, 0.3, 1.0, 2.0]))
+        inputs += [('pos', (float(pos[0]), float(pos[1]))), ('yaw', yaw), ('vel', vel)]
+        # Navigable terrain pixels around the stop_forward and go_forward thresholds
+        if rng.random() < 0.02:
+            inputs += [('nav_angles', None), ('nav_dists', None)]
+        else:
+            count = rng.choice([0, 20, 49, 50, 99, 100, 400, 499, 500, 1500])
+            inputs += [('nav_angles', rng.uniform(-0.7, 0.5, count)), ('nav_dists', rng.uniform(0, 60, count))]
+        if rng.random() < 0.15:
+            count = rng.integers(0, 20)
+            inputs += [('rock_angles', rng.uniform(-0.5, 0.5, count)), ('rock_dists', rng.uniform(5, 30, count))]
+        else:
+            inputs += [('rock_angles', np.zeros(0)), ('rock_dists', np.zeros(0))]
+        if rng.random() < 0.03:
+            sample_pos = tuple(pos + rng.uniform(-6, 6, 2))
+            inputs.append(('current_sample_pos', sample_pos))
+        inputs += [('near_sample', int(rng.random() < 0.2)), ('picking_up', int(rng.random() < 0.1)),
+                   ('send_pickup', False)]
+        if rng.random() < 0.03:
+            mode = MODES[rng.integers(len(MODES) - 1)] if rng.random() < 0.95 else 'home_dance'
+            inputs += [('mode', mode), ('stuck_yaw', yaw)]
+        if rng.random() < 0.01:
+            inputs.append(('start_pos', None))
+        if rng.random() < 0.02:
+            # Long steering in forward mode, to get to the safe guard against going in circles
+            inputs += [('mode', 'forward'), ('max_steer_frames', 500), ('steer', 15.0), ('vel', 1.0),
+                       ('picking_up', 0)]
+        if rng.random() < 0.02:
+            inputs += [('mode', 'stop'), ('unstuck_frames', 500), ('go_forward', 500)]
+        if rng.random() < 0.02:
+            inputs += [('go_forward', 100), ('low_forward_frames', 499)]
+        if rng.random() < 0.02:
+            inputs += [('stuck_frames', 50), ('throttle', 0.35), ('vel', 0.0), ('picking_up', 0)]
+        if rng.random() < 0.01:
+            inputs.append(('try_home_frames', 1))
+        # Detections, navigable around the rover and obstacles further away
+        side = 90 if idx == 800 else 5
+        cells = square(pos, side)
+        frame = (square(pos + rng.uniform(-8, 8, 2), 3), cells[:0], cells)
+        yield inputs, frame
+
+
+def same(a, b):
+    if isinstance(a, (np.ndarray, list, tuple)) or isinstance(b, (np.ndarray, list, tuple)):
+        return a is not None and b is not None and np.array_equal(a, b)
+    return a == b
+
+
+@pytest.mark.parametrize('explore', [False, True])
+def test_decision_machine(explore):
+    rng = np.random.default_rng(0)
+    reference = make_rover(explore)
+    rover = make_rover(explore)
+    machine = DecisionMachine()
+    modes = set()
+    sent_pickup = 0
+    for idx, (inputs, frame) in enumerate(random_inputs(rng, 3000)):
+        for Rover in (reference, rover):
+            for name, value in inputs:
+                setattr(Rover, name, value.copy() if isinstance(value, np.ndarray) else value)
+            Rover.worldmap.update(frame)
+        reference_step(reference)
+        machine.step(rover)
+        for name in FIELDS:
+            assert same(getattr(rover, name), getattr(reference, name)), \
+                'frame {}: {} is {}, expected {}'.format(idx, name, getattr(rover, name), getattr(reference, name))
+        modes.add(rover.mode)
+        sent_pickup += rover.send_pickup
+    # Every mode was reached and samples were picked up
+    assert modes == set(MODES)
+    assert sent_pickup > 0
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from worldmap import MapStatistics, WorldMap
+
+# The map statistics kept up to date by MapStatistics and the nonzero counts kept by the
+# worldmap are checked against a full recompute over the whole map, as the counts are added
+# to, decayed and merged.
+
+
+def random_ground_truth(rng, size):
+    ground_truth = np.zeros((size, size, 3), dtype=np.uint8)
+    ground_truth[:,:,1] = (rng.random((size, size)) < 0.6) * 255
+    return ground_truth
+
+
+# Return the percentage mapped and the fidelity computed from the whole map
+def recompute(worldmap, ground_truth):
+    resolution = worldmap.resolution
+    navigable = worldmap.view()[:,:,2] > 0
+    truth = ground_truth[:,:,1] > 0
+    # Ground truth of each worldmap cell, cells beyond the ground truth map are not navigable
+    fine_truth = np.zeros(navigable.shape, dtype=bool)
+    upsampled = truth.repeat(resolution, axis=0).repeat(resolution, axis=1)
+    rows = min(upsampled.shape[0], navigable.shape[0])
+    cols = min(upsampled.shape[1], navigable.shape[1])
+    fine_truth[:rows, :cols] = upsampled[:rows, :cols]
+    good = np.count_nonzero(navigable & fine_truth)
+    perc_mapped = round(100*good/resolution**2/np.count_nonzero(truth), 1)
+    fidelity = round(100*good/np.count_nonzero(navigable), 1) if navigable.any() else 0
+    return perc_mapped, fidelity
+
+
+def check(worldmap, stats, ground_truth):
+    assert (stats.perc_mapped(), stats.fidelity()) == recompute(worldmap, ground_truth)
+    counts = worldmap.view()
+    for channel in range(3):
+        nonzero = np.count_nonzero(counts[:,:,channel])
+        assert worldmap.count_nonzero(channel) == nonzero
+        if nonzero > 0:
+            assert stats.mean(channel) == pytest.approx(counts[:,:,channel].sum() / nonzero)
+    assert worldmap.count_nonzero() == np.count_nonzero(counts)
+
+
+def test_statistics(resolution, random_frame):
+    rng = np.random.default_rng(0)
+    ground_truth = random_ground_truth(rng, 50)
+    # The map reaches beyond the ground truth map
+    size = 60 * resolution
+    worldmap = WorldMap(size, resolution=resolution)
+    stats = MapStatistics(worldmap, ground_truth)
+    check(worldmap, stats, ground_truth)
+    for idx in range(40):
+        worldmap.update(random_frame(rng, size))
+        if idx % 10 == 9:
+            check(worldmap, stats, ground_truth)
+    # Decay until most detections are gone
+    for _ in range(4):
+        worldmap.decay()
+        check(worldmap, stats, ground_truth)
+
+
+def test_statistics_merge(resolution, random_frame):
+    rng = np.random.default_rng(1)
+    ground_truth = random_ground_truth(rng, 60)
+    size = 60 * resolution
+    worldmap = WorldMap(size, resolution=resolution)
+    other = WorldMap(size, resolution=resolution)
+    for _ in range(20):
+        worldmap.update(random_frame(rng, size))
+        other.update(random_frame(rng, size))
+    # Counts already in the map are accounted for
+    stats = MapStatistics(worldmap, ground_truth)
+    check(worldmap, stats, ground_truth)
+    worldmap.merge(other)
+    check(worldmap, stats, ground_truth)
+    check(worldmap.copy(), MapStatistics(worldmap.copy(), ground_truth), ground_truth)
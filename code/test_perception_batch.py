@@ -0,0 +1,19 @@
+import numpy as np
+
+from frame_store import open_run
+from replay import batch_map, default_dataset, replay
+
+# Mapping a run with perception_batch is checked against mapping it frame by frame with
+# perception_step, on the start of the recorded run of the repository.
+
+
+def test_batch_map(resolution):
+    run = open_run(default_dataset)
+    frames = 150
+    Rover, _ = replay(run, 0, frames, decide=False, map_resolution=resolution)
+    batched = batch_map(run, frames, 64, resolution)
+    assert Rover.worldmap.count_nonzero() > 0
+    assert np.array_equal(batched.worldmap.view(), Rover.worldmap.view())
+    assert np.array_equal(batched.worldmap.nonzero, Rover.worldmap.nonzero)
+    assert batched.map_stats.perc_mapped() == Rover.map_stats.perc_mapped()
+    assert batched.map_stats.fidelity() == Rover.map_stats.fidelity()
@@ -0,0 +1,120 @@
+import numpy as np
+
+from planner import GridPlanner
+from worldmap import WorldMap
+
+# The planner is checked on a small map of a 40 m square area: an open field with a wall
+# across it, a gap in the wall and a strip nothing was detected on south of the wall.
+
+EXTENT = 40
+
+
+# Return the flat cell indices of the worldmap cells of positions in meters
+def cells_at(worldmap, x, y):
+    x = (np.asarray(x) * worldmap.resolution).astype(np.int_)
+    y = (np.asarray(y) * worldmap.resolution).astype(np.int_)
+    return y * worldmap.size + x
+
+
+# Return a worldmap of the area at a resolution. Detections are made at the same points (in
+# meters) whatever the resolution, several per square meter.
+def build_map(resolution, gap=True):
+    worldmap = WorldMap(EXTENT * resolution, resolution=resolution)
+    offsets = (np.arange(4) + 0.5) / 4
+    x, y = np.meshgrid(np.arange(EXTENT)[:, None] + offsets, np.arange(EXTENT)[:, None] + offsets)
+    x = x.ravel()
+    y = y.ravel()
+    # A wall across the field at y = 20, with a gap at x = 30 unless closed, and an unknown strip
+    wall = (y >= 20) & (y < 21)
+    if gap:
+        wall &= (x < 30) | (x >= 32)
+    unknown = (x >= 8) & (x < 12) & (y < 20)
+    navigable = ~wall & ~unknown
+    for _ in range(3):
+        worldmap.update((cells_at(worldmap, x[wall], y[wall]), cells_at(worldmap, x[:0], y[:0]),
+                         cells_at(worldmap, x[navigable], y[navigable])))
+    return worldmap
+
+
+# Return the path of a planner as (x, y) cells
+def path_cells(planner):
+    return [divmod(int(cell), planner.size)[::-1] for cell in np.flatnonzero(planner.path_mask)]
+
+
+def test_plan_avoids_blocked_cells(resolution):
+    planner = GridPlanner(build_map(resolution))
+    assert planner.plan((10.5, 30.5), (10.5, 35.5))
+    assert planner.plan((10.5, 30.5), (10.5, 10.5))
+    cells = path_cells(planner)
+    # The only way through the wall is the gap
+    assert all(x in (30, 31) for x, y in cells if y == 20)
+    blocked = np.isinf(planner.costs())
+    assert not np.any(blocked[planner.path_mask])
+    assert planner.waypoints[-1] == (10.5, 10.5)
+
+
+def test_plan_fails_without_a_way_through(resolution):
+    planner = GridPlanner(build_map(resolution, gap=False))
+    # Unreachable goals end in a failed plan, searched over the whole reachable area
+    assert not planner.plan((10.5, 30.5), (10.5, 10.5))
+    assert planner.failed_plans == 1
+    assert planner.waypoints == []
+
+
+def test_next_waypoint_time_sliced(resolution):
+    worldmap = build_map(resolution)
+    planner = GridPlanner(worldmap)
+    planner.plan((10.5, 30.5), (2.5, 2.5))
+    # Without any time budget each call searches a few cells only
+    sliced = GridPlanner(worldmap, frame_budget=0)
+    calls = 0
+    while True:
+        sliced.next_waypoint((10.5, 30.5), (2.5, 2.5))
+        calls += 1
+        if sliced.search is None:
+            break
+        # The rover heads straight for the goal while the search goes on
+        assert sliced.waypoints == []
+    assert calls > 1
+    assert sliced.plans == 1
+    assert np.array_equal(sliced.path_mask, planner.path_mask)
+    assert sliced.waypoints == planner.waypoints
+
+
+def test_update_invalidates_path(resolution):
+    worldmap = build_map(resolution)
+    planner = GridPlanner(worldmap)
+    # The way crosses the unknown strip
+    assert planner.plan((2.5, 10.5), (18.5, 10.5))
+    cells = path_cells(planner)
+    crossed = [(x, y) for x, y in cells if 8 <= x < 12]
+    assert len(crossed) > 1
+    # Detections off the path or on good terrain do not invalidate it
+    worldmap.update((cells_at(worldmap, [35.5], [35.5]), [], []))
+    x, y = crossed[0]
+    worldmap.update(([], [], cells_at(worldmap, [x + 0.5], [y + 0.5])))
+    assert not planner.invalid
+    # An obstacle on a cell of the path that was never seen navigable does
+    x, y = crossed[-1]
+    worldmap.update((cells_at(worldmap, [x + 0.5], [y + 0.5]), [], []))
+    assert planner.invalid
+    # The next waypoint asked for replans around it
+    planner.next_waypoint((2.5, 10.5), (18.5, 10.5))
+    while planner.search is not None:
+        planner.next_waypoint((2.5, 10.5), (18.5, 10.5))
+    assert not planner.invalid
+    assert (x, y) not in path_cells(planner)
+
+
+def test_fine_map_plans_over_meter_cells():
+    coarse = GridPlanner(build_map(1))
+    fine = GridPlanner(build_map(4))
+    assert fine.size == coarse.size == EXTENT
+    cells = np.arange(EXTENT * EXTENT)
+    # The counts of a meter cell are the sum of the counts of the finer cells it covers
+    assert np.array_equal(fine.cell_counts(cells), coarse.cell_counts(cells))
+    assert np.array_equal(fine.costs(), coarse.costs())
+    for goal in ((10.5, 10.5), (2.5, 2.5), (38.5, 5.5)):
+        assert fine.plan((10.5, 30.5), goal) == coarse.plan((10.5, 30.5), goal)
+        assert np.array_equal(fine.path_mask, coarse.path_mask)
+        assert fine.waypoints == coarse.waypoints
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from spatial_index import SampleIndex
+
+# The grid hash queries are checked against brute force distances to all the points.
+
+
+def random_index(rng, count, cell_size):
+    index = SampleIndex(cell_size=cell_size, capacity=2)
+    points = rng.uniform(-20, 120, (count, 2))
+    for x, y in points:
+        index.insert(x, y)
+    return index, points
+
+
+# Return the (query index, point index) pairs closer than radius, sorted
+def brute_force_pairs(xs, ys, points, radius):
+    dists = np.hypot(xs[:, None] - points[None, :, 0], ys[:, None] - points[None, :, 1])
+    return sorted(zip(*np.nonzero(dists < radius)))
+
+
+@pytest.mark.parametrize('cell_size', [1.0, 3.0, 5.0, 20.0])
+@pytest.mark.parametrize('radius', [0.5, 3.0, 7.5])
+def test_pairs_within(cell_size, radius):
+    rng = np.random.default_rng(0)
+    index, points = random_index(rng, 200, cell_size)
+    assert len(index) == 200
+    assert np.array_equal(index.xy, points)
+    xs = rng.uniform(-30, 130, 1000)
+    ys = rng.uniform(-30, 130, 1000)
+    # Queries exactly on points and on cell edges
+    xs[:50] = points[:50, 0]
+    ys[:50] = points[:50, 1]
+    xs[50:100] = np.round(xs[50:100] / cell_size) * cell_size
+    query, found = index.pairs_within(xs, ys, radius)
+    assert sorted(zip(query, found)) == brute_force_pairs(xs, ys, points, radius)
+
+
+def test_pairs_within_empty():
+    index = SampleIndex()
+    query, found = index.pairs_within([1.0, 2.0], [3.0, 4.0], 3)
+    assert len(query) == 0 and len(found) == 0
+    index.insert(50, 50)
+    query, found = index.pairs_within([], [], 3)
+    assert len(query) == 0 and len(found) == 0
+    query, found = index.pairs_within([1.0], [1.0], 3)
+    assert len(query) == 0 and len(found) == 0
+
+
+def test_nearest_and_insert_unique():
+    rng = np.random.default_rng(1)
+    index, points = random_index(rng, 100, 5.0)
+    for x, y in rng.uniform(-30, 130, (500, 2)):
+        dists = np.hypot(points[:, 0] - x, points[:, 1] - y)
+        expected = np.argmin(dists) if dists.min() < 4 else None
+        assert index.nearest(x, y, 4) == expected
+    x, y = points[0]
+    assert index.insert_unique(x + 1, y, 3) is None
+    assert index.insert_unique(x + 1, y, 0.5) == 100
+    clone = index.copy()
+    clone.insert(500, 500)
+    assert len(index) == 101 and len(clone) == 102
+    assert index.nearest(500, 500, 1) is None
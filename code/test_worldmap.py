@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+
+from worldmap import WorldMap
+
+# The tiled worldmap is checked against a dense (size, size, 3) array of counts updated with
+# np.add.at, at 1 m cells and at 0.25 m cells, with a map side that is not a multiple of the
+# tile size and a pool that has to grow several times.
+
+
+# Add a frame of detections to the dense reference, saturating at max_count
+def dense_update(dense, frame, max_count):
+    flat = dense.reshape(-1)
+    for channel, cells in enumerate(frame):
+        np.add.at(flat, cells * 3 + channel, 1)
+    np.minimum(dense, max_count, out=dense)
+
+
+# Fade out the dense reference like WorldMap.decay
+def dense_decay(dense, shift):
+    nonzero = dense > 0
+    dense[nonzero] -= np.maximum(dense[nonzero] >> shift, 1)
+
+
+# Downsample the dense reference by factor, with the highest or the total count of each block
+def dense_view(dense, factor, total=False):
+    size = dense.shape[0]
+    rows = -(-size // factor)
+    padded = np.zeros((rows * factor, rows * factor, 3), dtype=np.int64)
+    padded[:size, :size] = dense
+    blocks = padded.reshape(rows, factor, rows, factor, 3)
+    if total:
+        return blocks.sum(axis=(1, 3))
+    return blocks.max(axis=(1, 3))
+
+
+def build(random_frame, resolution, frames=60, seed=0, dtype=np.uint32):
+    rng = np.random.default_rng(seed)
+    size = 60 * resolution + 7
+    worldmap = WorldMap(size, dtype, resolution=resolution, capacity=2)
+    dense = np.zeros((size, size, 3), dtype=np.int64)
+    for _ in range(frames):
+        frame = random_frame(rng, size)
+        worldmap.update(frame)
+        dense_update(dense, frame, worldmap.max_count)
+    return worldmap, dense
+
+
+def check_nonzero(worldmap, dense):
+    assert worldmap.count_nonzero() == np.count_nonzero(dense)
+    for channel in range(3):
+        assert worldmap.count_nonzero(channel) == np.count_nonzero(dense[:,:,channel])
+
+
+def test_update(resolution, random_frame):
+    worldmap, dense = build(random_frame, resolution)
+    assert worldmap.tile_size % resolution == 0
+    assert worldmap.allocated > 2
+    assert np.array_equal(worldmap.view(), dense)
+    assert np.array_equal(worldmap[:,:,2], dense[:,:,2])
+    check_nonzero(worldmap, dense)
+
+
+def test_update_saturates(resolution, random_frame):
+    rng = np.random.default_rng(3)
+    size = 60 * resolution
+    worldmap = WorldMap(size, np.uint8, resolution=resolution)
+    dense = np.zeros((size, size, 3), dtype=np.int64)
+    frame = random_frame(rng, size)
+    for _ in range(300):
+        worldmap.update(frame)
+        dense_update(dense, frame, worldmap.max_count)
+    assert dense.max() == 255
+    assert np.array_equal(worldmap.view(), dense)
+    check_nonzero(worldmap, dense)
+
+
+def test_decay(resolution, random_frame):
+    worldmap, dense = build(random_frame, resolution)
+    for _ in range(6):
+        worldmap.decay()
+        dense_decay(dense, worldmap.decay_shift)
+        assert np.array_equal(worldmap.view(), dense)
+        check_nonzero(worldmap, dense)
+
+
+def test_decay_interval(resolution, random_frame):
+    rng = np.random.default_rng(1)
+    size = 60 * resolution
+    worldmap = WorldMap(size, resolution=resolution, decay_interval=3, decay_shift=2)
+    dense = np.zeros((size, size, 3), dtype=np.int64)
+    for idx in range(20):
+        frame = random_frame(rng, size)
+        worldmap.update(frame)
+        dense_update(dense, frame, worldmap.max_count)
+        if (idx + 1) % 3 == 0:
+            dense_decay(dense, 2)
+    assert np.array_equal(worldmap.view(), dense)
+    check_nonzero(worldmap, dense)
+
+
+def test_merge(resolution, random_frame):
+    worldmap, dense = build(random_frame, resolution)
+    other, other_dense = build(random_frame, resolution, seed=1)
+    worldmap.merge(other)
+    assert np.array_equal(worldmap.view(), dense + other_dense)
+    check_nonzero(worldmap, dense + other_dense)
+
+
+def test_copy(resolution, random_frame):
+    worldmap, dense = build(random_frame, resolution)
+    clone = worldmap.copy()
+    assert np.array_equal(clone.view(), dense)
+    check_nonzero(clone, dense)
+    # The copy and the original change independently
+    rng = np.random.default_rng(2)
+    frame = random_frame(rng, worldmap.size)
+    clone.update(frame)
+    assert np.array_equal(worldmap.view(), dense)
+    dense_update(dense, frame, worldmap.max_count)
+    assert np.array_equal(clone.view(), dense)
+    check_nonzero(clone, dense)
+
+
+def test_view(resolution, random_frame):
+    worldmap, dense = build(random_frame, resolution)
+    for factor in (1, 2, 4, 5, worldmap.resolution):
+        assert np.array_equal(worldmap.view(factor), dense_view(dense, factor))
+        assert np.array_equal(worldmap.view(factor, total=True), dense_view(dense, factor, total=True))
+    with pytest.raises(ValueError):
+        worldmap.view(7)
+
+
+def test_tile_size_rounded():
+    worldmap = WorldMap(600, resolution=3)
+    assert worldmap.tile_size == 42
+    assert worldmap.view(3).shape == (200, 200, 3)
+
+
+def test_cell_counts(resolution, random_frame):
+    worldmap, dense = build(random_frame, resolution)
+    cells = np.arange(worldmap.size * worldmap.size)
+    assert np.array_equal(worldmap.cell_counts(cells), dense.reshape(-1, 3))
+    changed, values = worldmap.flat_nonzero()
+    order = np.argsort(changed)
+    assert np.array_equal(changed[order], np.flatnonzero(dense))
+    assert np.array_equal(values[order], dense.reshape(-1)[np.flatnonzero(dense)])
@@ -0,0 +1,325 @@
+import numpy as np
+
+from spatial_index import SampleIndex
+
+# Define a class to accumulate terrain detections in the worldmap.
+# The map keeps one count per cell and channel (0: obstacle, 1: rock sample, 2: navigable)
+# in a compact integer type that saturates instead of wrapping around. Detections are
+# accumulated from flat indices with np.bincount, so a cell hit by several pixels in the same
+# frame is counted as many times (a fancy indexed += only counts it once).
+# The map is size x size cells of 1/resolution meters, e.g. 800 cells at resolution 4 for
+# 200 m at 0.25 m per cell. The counts are stored in tile_size x tile_size tiles, allocated
+# the first time a cell of theirs is hit, so the memory and the time of the whole-map
+# operations (decay, copy) grow with the area explored rather than the size of the map.
+# tile_size is rounded up to a multiple of the resolution, so a tile covers whole meters and
+# the map can always be viewed at 1 m cells.
+# Cells are addressed by flat indices (y * size + x, or (y * size + x) * 3 + channel for a
+# count) whatever the storage. Indexing the map, e.g. Rover.worldmap[:,:,2], works on a dense
+# array assembled from the tiles, and view gives dense arrays downsampled for rendering.
+# The number of cells with detections in each channel is kept up to date as counts change,
+# so coverage queries do not scan the map. Counts should only be changed through the methods
+# of the class for it to stay right.
+class WorldMap():
+    def __init__(self, size=200, dtype=np.uint32, decay_interval=0, decay_shift=4, resolution=1,
+                 tile_size=40, capacity=16):
+        self.size = size
+        self.resolution = resolution
+        tile_size = -(-tile_size // resolution) * resolution
+        self.tile_size = tile_size
+        self.tiles_per_side = -(-size // tile_size)
+        self.max_count = np.iinfo(dtype).max
+        # Tile -> slot of its counts in the pool, -1 until the tile is first hit
+        self.slots = np.full(self.tiles_per_side * self.tiles_per_side, -1, dtype=np.int64)
+        # Counts of the allocated tiles, a row per slot grown by doubling, and the tile of each slot
+        self.pool = np.zeros((capacity, tile_size * tile_size * 3), dtype=dtype)
+        self.tiles = np.zeros(capacity, dtype=np.int64)
+        self.allocated = 0
+        # Optional decay: every decay_interval updates each count loses 1/2**decay_shift
+        # of its value (and at least 1), so detections that are not confirmed fade out
+        self.decay_interval = decay_interval
+        self.decay_shift = decay_shift
+        self.updates = 0
+        # Number of cells with detections in each channel
+        self.nonzero = np.zeros(3, dtype=np.int64)
+        # Functions called with the flat indices of the counts that changed and their
+        # values before and after the change, so statistics can be kept up to date
+        # without scanning the whole map
+        self.listeners = []
+
+    @property
+    def shape(self):
+        return (self.size, self.size, 3)
+
+    @property
+    def dtype(self):
+        return self.pool.dtype
+
+    # Bytes of count storage allocated
+    @property
+    def nbytes(self):
+        return self.pool[:self.allocated].nbytes
+
+    def __getitem__(self, index):
+        return self.view()[index]
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.view()
+        return self.view().astype(dtype)
+
+    # Return the slots and offsets in their tile of the counts at flat indices, allocating
+    # the tiles not allocated yet if allocate is True (their slots are -1 otherwise)
+    def locate(self, flat, allocate=False):
+        cells, channels = np.divmod(flat, 3)
+        y, x = np.divmod(cells, self.size)
+        tile_y, offset_y = np.divmod(y, self.tile_size)
+        tile_x, offset_x = np.divmod(x, self.tile_size)
+        tiles = tile_y * self.tiles_per_side + tile_x
+        offsets = (offset_y * self.tile_size + offset_x) * 3 + channels
+        slots = self.slots[tiles]
+        if allocate and np.any(slots < 0):
+            self.allocate(np.unique(tiles[slots < 0]))
+            slots = self.slots[tiles]
+        return slots, offsets
+
+    # Allocate zeroed counts for tiles
+    def allocate(self, tiles):
+        needed = self.allocated + len(tiles)
+        if needed > len(self.pool):
+            capacity = len(self.pool)
+            while capacity < needed:
+                capacity *= 2
+            pool = np.zeros((capacity, self.pool.shape[1]), dtype=self.pool.dtype)
+            pool[:self.allocated] = self.pool[:self.allocated]
+            self.pool = pool
+            self.tiles = np.concatenate((self.tiles, np.zeros(capacity - len(self.tiles), dtype=np.int64)))
+        self.slots[tiles] = np.arange(self.allocated, needed)
+        self.tiles[self.allocated:needed] = tiles
+        self.allocated = needed
+
+    # Return the counts at flat indices, of any shape
+    def values(self, flat):
+        slots, offsets = self.locate(flat)
+        values = np.zeros(np.shape(flat), dtype=self.dtype)
+        found = slots >= 0
+        values[found] = self.pool[slots[found], offsets[found]]
+        return values
+
+    # Return the counts of cells, flat cell indices, as an array of the 3 channel counts per cell
+    def cell_counts(self, cells):
+        return self.values(np.asarray(cells)[:, None] * 3 + np.arange(3))
+
+    # Return the flat indices and values of the counts above zero
+    def flat_nonzero(self):
+        slots, offsets = np.nonzero(self.pool[:self.allocated])
+        values = self.pool[slots, offsets]
+        cells, channels = np.divmod(offsets, 3)
+        offset_y, offset_x = np.divmod(cells, self.tile_size)
+        tile_y, tile_x = np.divmod(self.tiles[slots], self.tiles_per_side)
+        y = tile_y * self.tile_size + offset_y
+        x = tile_x * self.tile_size + offset_x
+        return (y * self.size + x) * 3 + channels, values
+
+    # Return the counts as a dense (rows, cols, 3) array, downsampled by factor in each
+    # direction if above 1: each cell of the view holds the highest count of the cells it
+    # covers, so detections keep their scale and thin walls stay visible, or with total the
+    # sum of their counts (as int64), the counts a map of cells that size would have had.
+    # The factor has to divide the tile size.
+    def view(self, factor=1, total=False):
+        if self.tile_size % factor != 0:
+            raise ValueError('Factor {} does not divide the tile size {}'.format(factor, self.tile_size))
+        side = self.tile_size // factor
+        per_side = self.tiles_per_side
+        tiles = np.zeros((per_side * per_side, side, side, 3), dtype=np.int64 if total else self.dtype)
+        counts = self.pool[:self.allocated].reshape(-1, side, factor, side, factor, 3)
+        if total:
+            counts = counts.sum(axis=(2, 4), dtype=np.int64)
+        elif factor > 1:
+            counts = counts.max(axis=(2, 4))
+        tiles[self.tiles[:self.allocated]] = counts.reshape(-1, side, side, 3)
+        dense = tiles.reshape(per_side, per_side, side, side, 3).transpose(0, 2, 1, 3, 4)
+        rows = -(-self.size // factor)
+        return dense.reshape(per_side * side, per_side * side, 3)[:rows, :rows]
+
+    # Add one detection for every flat cell index (y * size + x) given for each channel.
+    # cell_indices holds the obstacle, rock and navigable cell indices in that order.
+    def update(self, cell_indices):
+        flat = [cells * 3 + channel for channel, cells in enumerate(cell_indices) if len(cells) > 0]
+        if len(flat) > 0:
+            flat = np.concatenate(flat)
+            # The cells seen in a frame are all close to the rover, so only count over
+            # the range of indices actually hit rather than the whole map
+            lowest = flat.min()
+            hits = np.bincount(flat - lowest)
+            hit = np.flatnonzero(hits)
+            hits = hits[hit]
+            hit += lowest
+            self.add(hit, hits)
+        self.updates += 1
+        if self.decay_interval > 0 and self.updates % self.decay_interval == 0:
+            self.decay()
+
+    # Add increments to the counts at flat indices, given once each
+    def add(self, changed, increments):
+        slots, offsets = self.locate(changed, allocate=True)
+        before = self.pool[slots, offsets]
+        after = before + increments.astype(np.int64)
+        np.minimum(after, self.max_count, out=after)
+        self.pool[slots, offsets] = after
+        self.notify(changed, before, after)
+
+    # Return a copy of the map with the same counts and settings, without the listeners.
+    # Only the allocated tiles are copied, so it is cheap enough to take every frame (e.g.
+    # for drawing the map on another thread).
+    def copy(self):
+        capacity = max(self.allocated, 1)
+        clone = WorldMap(self.size, self.dtype, self.decay_interval, self.decay_shift, self.resolution,
+                         self.tile_size, capacity)
+        clone.slots = self.slots.copy()
+        clone.pool = self.pool[:capacity].copy()
+        clone.tiles = self.tiles[:capacity].copy()
+        clone.allocated = self.allocated
+        clone.updates = self.updates
+        clone.nonzero = self.nonzero.copy()
+        return clone
+
+    # Add the counts of another map of the same size, e.g. one built from part of a run
+    def merge(self, counts):
+        counts = np.asarray(counts).reshape(-1)
+        changed = np.flatnonzero(counts)
+        self.add(changed, counts[changed])
+
+    # Fade out all detections
+    def decay(self):
+        changed, before = self.flat_nonzero()
+        decrement = before >> self.decay_shift
+        np.maximum(decrement, 1, out=decrement)
+        after = before - decrement
+        slots, offsets = self.locate(changed)
+        self.pool[slots, offsets] = after
+        self.notify(changed, before, after)
+
+    # Register a function to be called with every change of the counts
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    # Number of cells with detections in a channel, or of counts above zero in all channels
+    # (the same as np.count_nonzero of the map)
+    def count_nonzero(self, channel=None):
+        if channel is None:
+            return int(self.nonzero.sum())
+        return int(self.nonzero[channel])
+
+    # Update the nonzero counts and call the listeners with a change of the counts
+    def notify(self, changed, before, after):
+        channels = changed % 3
+        self.nonzero += np.bincount(channels[(before == 0) & (after > 0)], minlength=3)
+        self.nonzero -= np.bincount(channels[(before > 0) & (after == 0)], minlength=3)
+        for listener in self.listeners:
+            listener(changed, before, after)
+
+    # Confidence of each cell in a channel, the fraction of its detections that belong
+    # to that channel. Cells without detections have zero confidence.
+    def confidence(self, channel):
+        counts = self.view()
+        total = counts.sum(axis=2, dtype=np.float32)
+        confidence = np.zeros(total.shape, dtype=np.float32)
+        np.divide(counts[:,:,channel], total, out=confidence, where=total > 0)
+        return confidence
+
+
+# Define a class keeping the map statistics shown on screen up to date as the worldmap changes.
+# Only the cells whose counts changed in a frame are looked at, so the cost of the statistics
+# does not grow with the size of the map. The ground truth map has 1 meter cells, a worldmap
+# cell is checked against the ground truth cell it lies in.
+class MapStatistics():
+    def __init__(self, worldmap, ground_truth):
+        # Cells that are navigable in the ground truth map
+        self.ground_truth = ground_truth[:,:,1] > 0
+        self.tot_map_pix = np.count_nonzero(self.ground_truth)
+        self.worldmap = worldmap
+        self.resolution = worldmap.resolution
+        # Total detections of each channel
+        self.totals = np.zeros(3, dtype=np.int64)
+        # Navigable cells, and those of them that are navigable in the ground truth map
+        self.tot_nav_pix = 0
+        self.good_nav_pix = 0
+        # Rock cells detected since the sample positions were last checked
+        self.new_rock_cells = []
+        self.rocks_removed = False
+        self.samples_pos = None
+        self.samples_located = None
+        self.sample_index = None
+        worldmap.add_listener(self.update)
+        # Account for anything already in the map
+        changed, counts = worldmap.flat_nonzero()
+        if len(changed) > 0:
+            self.update(changed, np.zeros(len(changed), dtype=worldmap.dtype), counts)
+
+    # Worldmap listener
+    def update(self, changed, before, after):
+        channels = changed % 3
+        self.totals += np.bincount(channels, weights=after.astype(np.int64) - before,
+                                   minlength=3).astype(np.int64)
+        added = (before == 0) & (after > 0)
+        removed = (before > 0) & (after == 0)
+
+        nav_added = changed[added & (channels == 2)] // 3
+        nav_removed = changed[removed & (channels == 2)] // 3
+        self.tot_nav_pix += len(nav_added) - len(nav_removed)
+        self.good_nav_pix += self.count_good(nav_added) - self.count_good(nav_removed)
+
+        rock_added = changed[added & (channels == 1)] // 3
+        if len(rock_added) > 0:
+            self.new_rock_cells.append(rock_added)
+        if np.any(removed & (channels == 1)):
+            self.rocks_removed = True
+
+    # Number of worldmap cells, flat cell indices, that are navigable in the ground truth map
+    def count_good(self, cells):
+        if len(cells) == 0:
+            return 0
+        y, x = np.divmod(cells, self.worldmap.size)
+        y //= self.resolution
+        x //= self.resolution
+        inside = (y < self.ground_truth.shape[0]) & (x < self.ground_truth.shape[1])
+        return np.count_nonzero(self.ground_truth[y[inside], x[inside]])
+
+    # Mean number of detections of the cells with detections in a channel
+    def mean(self, channel):
+        nonzero = self.worldmap.count_nonzero(channel)
+        if nonzero == 0:
+            return 0
+        return self.totals[channel] / nonzero
+
+    # Percentage of the ground truth map that has been successfully found
+    def perc_mapped(self):
+        return round(100*self.good_nav_pix/self.resolution**2/self.tot_map_pix, 1)
+
+    # Number of good map pixel detections divided by total pixels found to be navigable terrain
+    def fidelity(self):
+        if self.tot_nav_pix > 0:
+            return round(100*self.good_nav_pix/self.tot_nav_pix, 1)
+        return 0
+
+    # Return a boolean array telling which of the known sample positions have a rock detected
+    # within 3 meters. Only rock cells detected since the last call are checked, against a
+    # spatial index of the sample positions.
+    def located_samples(self, worldmap, samples_pos):
+        size = worldmap.shape[1]
+        if self.samples_pos is not samples_pos or self.rocks_removed:
+            # New sample positions or forgotten detections, check against the whole map
+            self.samples_pos = samples_pos
+            self.samples_located = np.zeros(len(samples_pos[0]), dtype=bool)
+            self.sample_index = SampleIndex(cell_size=3)
+            for sample_x, sample_y in zip(samples_pos[0], samples_pos[1]):
+                self.sample_index.insert(sample_x, sample_y)
+            self.new_rock_cells = [np.flatnonzero(worldmap[:,:,1])]
+            self.rocks_removed = False
+        if len(self.new_rock_cells) > 0:
+            rock_cells = np.concatenate(self.new_rock_cells)
+            self.new_rock_cells = []
+            rock_y, rock_x = np.divmod(rock_cells, size)
+            _, located = self.sample_index.pairs_within(rock_x / self.resolution, rock_y / self.resolution, 3)
+            self.samples_located[located] = True
+        return self.samples_located